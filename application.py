@@ -3,47 +3,185 @@ Backend server for demo of online coreference resolution.
 """
 
 import os
+import sys
+import argparse
 os.environ['DATA_PATH'] = os.getenv('DATA_PATH', './data')
 
+import logging
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper())
+
 import coref.api
+import coref.metrics
+import coref.serving
+from coref.api import is_true, pair_options
+from coref.sessions import SessionNotFound
 import json
-from flask import Flask, render_template, request, redirect, url_for
+from flask import Flask, Response, render_template, request, redirect, url_for
 app = Flask(__name__, static_folder='static', template_folder='templates')
+# Sessions live in the memory of the process which created them, so they're
+# disabled when serving with several worker processes (see --workers)
+app.config['SESSIONS_ENABLED'] = True
 
 @app.route('/')
 @app.route('/index')
 def index():
     return render_template('index.html')
 
+
 @app.route('/api/clusters', methods=['POST'])
 def clusters():
     text = request.form['document']
-    model = int(request.form['model'])
-    automatic = request.form['automaticMentionDetection']
+    model_key = coref.api.MODEL_KEYS[int(request.form['model'])]
+    automatic = is_true(request.form['automaticMentionDetection'])
+
+    # Parse document and perform coreference resolution
+    result, = coref.api.resolve_texts([text], [model_key], [automatic], [pair_options(request.form)])
+
+    return json.dumps(result)
+
+
+@app.route('/api/clusters/batch', methods=['POST'])
+def clusters_batch():
+    """
+    Resolves several documents at once, given as JSON:
+     {"documents": [{"document": "...", "model": 0, "automaticMentionDetection": true}, ...]}
+    Each document accepts the same fields as /api/clusters.
+    """
+    documents = request.get_json(force=True)['documents']
+
+    results = coref.api.resolve_texts(
+        [document['document'] for document in documents],
+        [coref.api.MODEL_KEYS[int(document['model'])] for document in documents],
+        [is_true(document.get('automaticMentionDetection', False)) for document in documents],
+        [pair_options(document) for document in documents]
+    )
+
+    return json.dumps({'results': results})
+
+
+@app.route('/api/sessions', methods=['POST'])
+def create_session():
+    """
+    Creates an incremental coreference session, with the same model and
+     automaticMentionDetection fields as /api/clusters (as form or JSON).
+    """
+    if not app.config['SESSIONS_ENABLED']:
+        return sessions_disabled()
+    form = request.get_json(silent=True) or request.form
+    model_key = coref.api.MODEL_KEYS[int(form['model'])]
+    session_id = coref.api.create_session(model_key, is_true(form.get('automaticMentionDetection', False)))
+    return json.dumps({'session': session_id})
+
+
+@app.route('/api/sessions/<session_id>', methods=['GET', 'DELETE'])
+def session(session_id):
+    if not app.config['SESSIONS_ENABLED']:
+        return sessions_disabled()
+    try:
+        if request.method == 'DELETE':
+            coref.api.delete_session(session_id)
+            return json.dumps({'session': session_id})
+        return json.dumps(coref.api.get_session(session_id))
+    except SessionNotFound:
+        return session_not_found(session_id)
+
+
+@app.route('/api/sessions/<session_id>/append', methods=['POST'])
+def append_to_session(session_id):
+    """
+    Appends the given document field's text to the session, as new sentences,
+     returning the updated mentions and clusters.
+    """
+    if not app.config['SESSIONS_ENABLED']:
+        return sessions_disabled()
+    text = (request.get_json(silent=True) or request.form)['document']
+    try:
+        return json.dumps(coref.api.append_to_session(session_id, text))
+    except SessionNotFound:
+        return session_not_found(session_id)
 
-    # Parse document
-    if automatic == 'true':
-        doc = coref.api.automatic_mention_detection(text, 'es' if model == 1 else 'pt')
-    else:
-        doc = coref.api.parse_manual_mentions(text)
 
-    # Perform coreference resolution
-    clusters = coref.api.cluster_mentions(doc, ['pt', 'es', 'pt-transferred'][model])
-    
-    # Convert sets to lists, and numpy.int to native integers, in order to be JSON serializable
-    clusters = [[int(i) for i in c] for c in clusters]
+def sessions_disabled():
+    body = json.dumps({'error': 'Sessions are unavailable when serving with several worker processes (--workers), '
+                                'as each worker keeps its own sessions.'})
+    return Response(body, status=501, mimetype='application/json')
 
-    # Clusters' order is from last to first
-    clusters.reverse()
 
+def session_not_found(session_id):
+    body = json.dumps({'error': 'Session {} not found, it may have expired.'.format(session_id)})
+    return Response(body, status=404, mimetype='application/json')
+
+
+@app.errorhandler(coref.api.MentionSyntaxError)
+def mention_syntax_error(error):
+    """
+    Malformed manual mentions, with the character position of the error.
+    """
+    body = json.dumps({'error': str(error), 'position': error.position})
+    return Response(body, status=400, mimetype='application/json')
+
+
+@app.errorhandler(coref.api.InvalidOptionError)
+def invalid_option(error):
+    body = json.dumps({'error': str(error)})
+    return Response(body, status=400, mimetype='application/json')
+
+
+@app.route('/api/stats', methods=['GET'])
+def stats():
     return json.dumps({
-        'mentions': [m.full_mention for m in doc.mentions],
-        'clusters': clusters
+        'result_cache': coref.api.result_cache.get_stats(),
+        'models': {key: coref.api.cached_models.get_stats(key) for key in list(coref.api.cached_models.models)},
+        'schedulers': coref.api.cached_models.get_scheduler_stats(),
+        'sessions': coref.api.session_store.get_stats(),
+        'mention_detection': coref.api.entity_recognizer.get_stats(),
     })
 
 
+@app.route('/api/ready', methods=['GET'])
+def ready():
+    """
+    Readiness of the server: 200 once the tokenizers and models are loaded
+     (see coref.api.set_up), or else 503, with each one's loading status.
+    """
+    status = coref.api.readiness()
+    return Response(json.dumps(status), status=200 if status['ready'] else 503, mimetype='application/json')
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Per-stage latencies, document sizes, and cache, model and scheduler
+     statistics, in the Prometheus text format.
+    """
+    return Response(coref.metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Coreference resolution web server.')
+    parser.add_argument('--host', default=os.getenv('HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', '5000')))
+    parser.add_argument('--workers', type=int, default=int(os.getenv('WORKERS', '1')),
+                        help='Number of worker processes, 0 for one per CPU. With more than one, the '
+                             'tokenizers and polyglot models are shared by the forked workers.')
+    parser.add_argument('--threaded', action='store_true',
+                        help='Handle concurrent requests in threads in each worker process.')
+    return parser.parse_args(argv)
+
+
 if __name__ == '__main__':
-    coref.api.set_up()
+    args = parse_args(sys.argv[1:])
+
+    if args.workers == 1:
+        coref.api.set_up()
 
-    # Start server
-    app.run()
\ No newline at end of file
+        # Start server
+        app.run(host=args.host, port=args.port)
+    else:
+        app.config['SESSIONS_ENABLED'] = False
+        coref.serving.serve(
+            app, coref.serving.bind_socket(args.host, args.port), workers=args.workers,
+            preload=lambda: coref.api.set_up('eager', models=False),
+            post_fork=lambda: coref.api.set_up('eager', shared=False),
+            threaded=args.threaded
+        )
\ No newline at end of file
@@ -0,0 +1,131 @@
+"""
+Benchmark of the antecedent selection and cluster construction used by the
+ clustering functions, over dense and sparse affinity matrices, against the
+ previous per-mention Python loops.
+
+Usage: python -m benchmarks.bench_clustering [num_mentions ...]
+The reference loops are only timed up to REFERENCE_MAX_MENTIONS mentions.
+"""
+
+import sys
+import timeit
+import numpy as np
+from scipy.sparse import csr_matrix
+from coref.clustering_utils import Link, best_antecedent_links, closest_antecedent_links, \
+    coreference_links_to_entity_clusters, dense_affinity_matrix
+
+
+REFERENCE_MAX_MENTIONS = 5000
+THRESHOLD = 0.5
+
+
+def synthetic_affinity_matrix(num_mentions, prob_coref=0.3, seed=42):
+    """
+    Scores below the threshold, except for one random antecedent of ~prob_coref
+     of the mentions.
+    """
+    rng = np.random.RandomState(seed)
+    affinity_matrix = np.empty(shape=(num_mentions, num_mentions), dtype=np.float32)
+    for start in range(0, num_mentions, 1000):
+        rows = affinity_matrix[start: start + 1000]
+        rows[:] = rng.rand(*rows.shape) * THRESHOLD
+
+    mentions = np.arange(1, num_mentions)
+    coreferent = mentions[rng.rand(len(mentions)) < prob_coref]
+    antecedents = (rng.rand(len(coreferent)) * coreferent).astype(int)
+    affinity_matrix[coreferent, antecedents] = 0.9
+    return affinity_matrix
+
+
+def reference_closest_antecedent_links(affinity_matrix, threshold):
+    num_mentions = len(affinity_matrix)
+    links = np.ndarray(shape=(num_mentions,), dtype=int)
+    links.fill(Link.NO_ANTECEDENT)
+    for current_idx in range(1, num_mentions):
+        for antecedent_idx in range(current_idx - 1, -1, -1):
+            if affinity_matrix[current_idx, antecedent_idx] > threshold:
+                links[current_idx] = antecedent_idx
+                break
+    return links
+
+
+def reference_best_antecedent_links(affinity_matrix, threshold):
+    num_mentions = len(affinity_matrix)
+    links = np.ndarray(shape=(num_mentions,), dtype=int)
+    links.fill(Link.NO_ANTECEDENT)
+    for current_idx in range(1, num_mentions):
+        mention_scores = [score if score > threshold else 0 for score in affinity_matrix[current_idx]]
+        best_antecedent = np.argmax(mention_scores)
+        if best_antecedent < current_idx:
+            links[current_idx] = best_antecedent
+    return links
+
+
+def reference_links_to_entity_clusters(links):
+    links = np.array(links)
+    clusters = []
+    for i in range(len(links) - 1, -1, -1):
+        new_cluster = set()
+        j = i
+        while True:
+            antecedent = links[j]
+            links[j] = Link.PROCESSED
+            new_cluster.add(j)
+            if antecedent == Link.NO_ANTECEDENT:
+                clusters.append(new_cluster)
+                break
+            elif antecedent == Link.PROCESSED:
+                previous_cluster_idx = next(idx for idx, c in enumerate(clusters) if j in c)
+                clusters[previous_cluster_idx].update(new_cluster)
+                break
+            j = antecedent
+    return clusters
+
+
+def best_time(func):
+    return min(timeit.repeat(func, number=1, repeat=3))
+
+
+def run(num_mentions):
+    affinity_matrix = synthetic_affinity_matrix(num_mentions)
+    links = closest_antecedent_links(affinity_matrix, THRESHOLD)
+
+    rows, cols = np.nonzero(affinity_matrix > THRESHOLD)
+    lower = rows > cols
+    rows, cols = rows[lower], cols[lower]
+    sparse_affinity_matrix = csr_matrix((affinity_matrix[rows, cols], (rows, cols)), shape=affinity_matrix.shape)
+    for name, select in [('closest antecedent', closest_antecedent_links), ('best antecedent', best_antecedent_links)]:
+        if num_mentions <= REFERENCE_MAX_MENTIONS:
+            symmetric_affinity_matrix = dense_affinity_matrix(sparse_affinity_matrix)
+            assert np.array_equal(select(sparse_affinity_matrix, THRESHOLD), select(symmetric_affinity_matrix, THRESHOLD)),\
+                'sparse and dense outputs differ for {}'.format(name)
+        elapsed = best_time(lambda: select(sparse_affinity_matrix, THRESHOLD))
+        print('{:>6} mentions, {:<18}: {:.4f}s (sparse, {} stored scores)'.format(
+            num_mentions, name, elapsed, sparse_affinity_matrix.nnz))
+
+    benchmarks = [
+        ('closest antecedent', lambda: closest_antecedent_links(affinity_matrix, THRESHOLD),
+            lambda: reference_closest_antecedent_links(affinity_matrix, THRESHOLD)),
+        ('best antecedent', lambda: best_antecedent_links(affinity_matrix, THRESHOLD),
+            lambda: reference_best_antecedent_links(affinity_matrix, THRESHOLD)),
+        ('links to clusters', lambda: coreference_links_to_entity_clusters(links),
+            lambda: reference_links_to_entity_clusters(links)),
+    ]
+    for name, func, reference in benchmarks:
+        elapsed = best_time(func)
+        line = '{:>6} mentions, {:<18}: {:.4f}s'.format(num_mentions, name, elapsed)
+        if num_mentions <= REFERENCE_MAX_MENTIONS:
+            result, expected = func(), reference()
+            if isinstance(result, np.ndarray):
+                assert np.array_equal(result, expected), 'outputs differ for {}'.format(name)
+            else:
+                assert result == [set(map(int, c)) for c in expected], 'outputs differ for {}'.format(name)
+            reference_elapsed = best_time(reference)
+            line += ', reference {:.4f}s, speedup {:.1f}x'.format(reference_elapsed, reference_elapsed / elapsed)
+        print(line)
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1000, 2000, 5000, 10000, 20000]
+    for size in sizes:
+        run(size)
@@ -0,0 +1,58 @@
+"""
+Micro-benchmark for the distance features of mention pairs: per-pair binning
+ (previous implementation) versus binning whole distance columns at once.
+
+Usage: python -m benchmarks.bench_distance_features [num_pairs ...]
+"""
+
+import sys
+import timeit
+import numpy as np
+from coref.data import DISTANCE_BINS, process_mention_pairs_to_distance_features
+from coref.utils import bin_scalar
+
+
+class SyntheticMentionPairs(object):
+    """
+    Stand-in for semeval.MentionPairs, holding random distance columns.
+    """
+
+    def __init__(self, num_pairs, seed=42):
+        rng = np.random.RandomState(seed)
+        self.sent_dist = rng.geometric(0.2, size=num_pairs) - 1
+        self.token_dist = rng.geometric(0.02, size=num_pairs) - 1
+        self.mention_dist = rng.geometric(0.05, size=num_pairs)
+
+    def __len__(self):
+        return len(self.sent_dist)
+
+
+def per_pair_distance_features(mention_pairs, num_features=2):
+    bin_distance = lambda x: bin_scalar(x, DISTANCE_BINS)
+    distances = [mention_pairs.sent_dist, mention_pairs.token_dist, mention_pairs.mention_dist]
+
+    X_scalar = np.empty(shape=(len(mention_pairs), num_features), dtype='float32')
+    for idx in range(len(mention_pairs)):
+        X_scalar[idx] = [bin_distance(distances[f][idx]) for f in range(num_features)]
+    return X_scalar
+
+
+def run(num_pairs, num_features=2):
+    mps = SyntheticMentionPairs(num_pairs)
+    assert np.array_equal(
+        per_pair_distance_features(mps, num_features),
+        process_mention_pairs_to_distance_features(mps, num_features)
+    ), 'vectorized features differ from per-pair features'
+
+    repeat = 1 if num_pairs > 100000 else 5
+    per_pair = min(timeit.repeat(lambda: per_pair_distance_features(mps, num_features), number=1, repeat=repeat))
+    vectorized = min(timeit.repeat(lambda: process_mention_pairs_to_distance_features(mps, num_features), number=1, repeat=repeat))
+    print('{:>9} pairs, {} features: per-pair {:.4f}s, vectorized {:.4f}s, speedup {:.1f}x'.format(
+        num_pairs, num_features, per_pair, vectorized, per_pair / vectorized))
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 1000000]
+    for size in sizes:
+        for num_features in (2, 3):
+            run(size, num_features)
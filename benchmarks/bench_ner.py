@@ -0,0 +1,69 @@
+"""
+Benchmark of automatic mention detection (coref.ner) on a long synthetic text:
+ polyglot's single pass over the whole text against the entity recognizer,
+ in the calling thread and in process pools, with cold and warm caches.
+Requires polyglot's embeddings and NER data for the chosen language.
+
+Usage: python -m benchmarks.bench_ner [--sentences N] [--workers 0 2 4] [--language pt]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from polyglot.text import Text
+from coref.ner import EntityRecognizer
+
+WORDS = {
+    'pt': ['o', 'a', 'de', 'em', 'que', 'viu', 'disse', 'casa', 'cidade', 'Maria', 'João', 'Lisboa',
+           'Porto', 'Portugal', 'Benfica', 'Ana', 'Silva', 'Europa', 'governo', 'presidente'],
+    'es': ['el', 'la', 'de', 'en', 'que', 'vio', 'dijo', 'casa', 'ciudad', 'María', 'Juan', 'Madrid',
+           'Sevilla', 'España', 'Barcelona', 'Ana', 'García', 'Europa', 'gobierno', 'presidente'],
+}
+
+
+def synthetic_text(language, num_sentences, seed=42):
+    rng = random.Random(seed)
+    return ' '.join(
+        ' '.join(rng.choice(WORDS[language]) for _ in range(rng.randint(5, 25))).capitalize() + '.'
+        for _ in range(num_sentences)
+    )
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def run(language, num_sentences, workers):
+    text = Text(synthetic_text(language, num_sentences), hint_language_code=language)
+    Text('Lisboa e Madrid.', hint_language_code=language).entities    # load the models before forking
+    expected, single_pass = timed(lambda: [(c.start, c.end, c.tag) for c in text.entities])
+
+    results = {'words': len(text.words), 'sentences': len(text.sentences), 'single_pass_s': single_pass}
+    for num_workers in workers:
+        recognizer = EntityRecognizer(num_workers=num_workers)
+        cold, cold_elapsed = timed(lambda: recognizer.entities(text))
+        warm, warm_elapsed = timed(lambda: recognizer.entities(text))
+        assert cold == expected and warm == expected, 'entities differ from the single pass'
+        results[num_workers] = {'cold_s': cold_elapsed, 'warm_s': warm_elapsed,
+                                'speedup': single_pass / cold_elapsed}
+    return results
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Throughput of parallel, cached mention detection.')
+    parser.add_argument('--sentences', type=int, default=2000)
+    parser.add_argument('--workers', type=int, nargs='+', default=sorted({0, 2, os.cpu_count() or 1}))
+    parser.add_argument('--language', choices=sorted(WORDS), default='pt')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+    results = run(args.language, args.sentences, args.workers)
+    results['cpu_count'] = os.cpu_count()
+    print(json.dumps(results, indent=2))
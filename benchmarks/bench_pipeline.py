@@ -0,0 +1,220 @@
+"""
+Benchmark of each stage of the coreference pipeline (as in
+ coref.api.cluster_mentions) and of the clustering functions, over synthetic
+ documents scored by a deterministic stand-in model (see benchmarks.stubs).
+
+Reports each stage's latency percentiles, throughput and peak memory as JSON,
+ so results of different commits can be compared offline.
+
+Usage: python -m benchmarks.bench_pipeline [--tokens N] [--sentences N] [--mentions N]
+                                           [--repeat N] [--output results.json]
+                                           [--compare baseline.json]
+"""
+
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import subprocess
+import tracemalloc
+import numpy as np
+import coref.api
+from coref.semeval import Document, Mention, Token
+from coref.data import process_mention_pairs_to_distance_features, process_mentions_to_indices
+from coref.clustering import cluster_by_affinity_propagation, cluster_by_best_antecedent, \
+    cluster_by_closest_antecedent, cluster_by_closest_antecedent_lazy
+from coref.clustering_utils import closest_antecedent_links, coreference_links_to_entity_clusters, \
+    generate_sparse_affinity_matrix
+from .stubs import install_stubs
+
+
+MODEL_KEY = 'pt'
+THRESHOLD = 0.5
+# Affinity propagation is quadratic in memory and slow to converge, thus only run on smaller documents
+AFFINITY_PROPAGATION_MAX_MENTIONS = 2000
+
+
+def synthetic_document(num_tokens, num_sentences, num_mentions, vocabulary_size=1000, max_mention_length=4, seed=42):
+    """
+    Document with the given number of tokens, split into sentences of random
+     lengths, and num_mentions distinct random spans (possibly nested) within
+     sentences. Words follow a Zipf distribution, so surface forms repeat as in
+     real text.
+    """
+    if num_sentences > num_tokens:
+        raise ValueError('Expected at most one sentence per token, got {} sentences for {} tokens.'
+                         .format(num_sentences, num_tokens))
+    rng = np.random.RandomState(seed)
+    doc = Document('synthetic-document')
+
+    sentence_lengths = 1 + rng.multinomial(num_tokens - num_sentences, np.ones(num_sentences) / num_sentences)
+    words = np.minimum(rng.zipf(1.5, size=num_tokens), vocabulary_size)
+    sentence_starts = np.cumsum(sentence_lengths) - sentence_lengths
+    for sentence_idx, (start, length) in enumerate(zip(sentence_starts, sentence_lengths)):
+        for token_idx in range(length):
+            doc.add_token(Token([token_idx, 'w{}'.format(words[start + token_idx])], sentence_idx))
+
+    max_spans = sum(
+        sum(length - span_length + 1 for span_length in range(1, min(length, max_mention_length) + 1))
+        for length in sentence_lengths
+    )
+    if num_mentions > max_spans:
+        raise ValueError('Expected at most {} mentions for this document, got {}.'.format(max_spans, num_mentions))
+
+    sentence_of_token = np.repeat(np.arange(num_sentences), sentence_lengths)
+    sentence_ends = sentence_starts + sentence_lengths
+    spans = set()
+    while len(spans) < num_mentions:
+        start = rng.randint(num_tokens)
+        end = min(start + rng.randint(1, max_mention_length + 1), sentence_ends[sentence_of_token[start]])
+        spans.add((start, end))
+
+    for start, end in sorted(spans, key=lambda span: (span[0], -span[1])):
+        doc.mentions.append(Mention(doc.tokens[start: end]))
+    return doc
+
+
+def percentile_ms(latencies, q):
+    return 1000 * float(np.percentile(latencies, q))
+
+
+def measure(func, repeat):
+    """
+    Runs func repeat times, and once more tracing memory allocations.
+    @returns (latencies in seconds, peak traced memory in bytes)
+    """
+    func()  # warm-up
+    latencies = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return latencies, peak_memory
+
+
+def stage_report(latencies, peak_memory, num_mentions, num_pairs):
+    mean = float(np.mean(latencies))
+    return {
+        'runs': len(latencies),
+        'mean_ms': 1000 * mean,
+        'p50_ms': percentile_ms(latencies, 50),
+        'p90_ms': percentile_ms(latencies, 90),
+        'p99_ms': percentile_ms(latencies, 99),
+        'max_ms': 1000 * float(np.max(latencies)),
+        'mentions_per_second': num_mentions / mean if mean else None,
+        'pairs_per_second': num_pairs / mean if mean else None,
+        'peak_memory_bytes': peak_memory,
+    }
+
+
+def run(num_tokens, num_sentences, num_mentions, repeat=5, seed=42):
+    cached_models = coref.api.cached_models
+    install_stubs(cached_models, MODEL_KEY)
+    tokenizer = cached_models.get_tokenizer(MODEL_KEY)
+    sequence_cache = cached_models.get_sequence_cache(MODEL_KEY)
+
+    doc = synthetic_document(num_tokens, num_sentences, num_mentions, seed=seed)
+    mps = doc.generate_mention_pairs()
+    X_mentions = process_mentions_to_indices(doc.mentions, tokenizer, coref.api.MAX_MENTION_LEN, sequence_cache)
+    X_scalar = process_mention_pairs_to_distance_features(mps)
+    predictions = cached_models.predict_pairs(MODEL_KEY, X_mentions, mps.m1_idx, mps.m2_idx, X_scalar, True)
+    affinity_matrix = generate_sparse_affinity_matrix(doc, predictions, THRESHOLD)
+    links = closest_antecedent_links(affinity_matrix, THRESHOLD)
+    clusters = coreference_links_to_entity_clusters(links)
+
+    stages = [
+        ('pair_generation', lambda: doc.generate_mention_pairs()),
+        ('featurization', lambda: (
+            process_mentions_to_indices(doc.mentions, tokenizer, coref.api.MAX_MENTION_LEN, sequence_cache),
+            process_mention_pairs_to_distance_features(mps))),
+        ('predict', lambda: cached_models.predict_pairs(
+            MODEL_KEY, X_mentions, mps.m1_idx, mps.m2_idx, X_scalar, True)),
+        ('affinity', lambda: generate_sparse_affinity_matrix(doc, predictions, THRESHOLD)),
+        ('clustering', lambda: coreference_links_to_entity_clusters(closest_antecedent_links(affinity_matrix, THRESHOLD))),
+        ('serialization', lambda: json.dumps(coref.api.serialize_clusters(doc, clusters))),
+        ('cluster_mentions', lambda: coref.api.cluster_mentions(doc, MODEL_KEY)),
+        ('cluster_mentions_lazy', lambda: coref.api.cluster_mentions(doc, MODEL_KEY, lazy=True)),
+        ('cluster_by_closest_antecedent', lambda: cluster_by_closest_antecedent(doc, predictions)),
+        ('cluster_by_closest_antecedent_lazy', lambda: cluster_by_closest_antecedent_lazy(
+            doc, coref.api.pair_scorer(doc, MODEL_KEY))),
+        ('cluster_by_best_antecedent', lambda: cluster_by_best_antecedent(doc, predictions)),
+    ]
+    if num_mentions <= AFFINITY_PROPAGATION_MAX_MENTIONS:
+        stages.append(('cluster_by_affinity_propagation', lambda: cluster_by_affinity_propagation(doc, predictions)))
+
+    report = dict()
+    for name, func in stages:
+        np.random.seed(seed)    # affinity propagation's random tie-breaking
+        latencies, peak_memory = measure(func, repeat)
+        report[name] = stage_report(latencies, peak_memory, len(doc.mentions), len(mps))
+    return report
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """
+    Ratio of each stage's median latency to the baseline's (above 1 is slower).
+    """
+    return {
+        name: stage['p50_ms'] / baseline['stages'][name]['p50_ms']
+        for name, stage in results['stages'].items()
+        if name in baseline['stages'] and baseline['stages'][name]['p50_ms']
+    }
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Benchmark of the coreference pipeline with a stand-in model.')
+    parser.add_argument('--tokens', type=int, default=5000, help='Number of tokens of the document.')
+    parser.add_argument('--sentences', type=int, default=250, help='Number of sentences of the document.')
+    parser.add_argument('--mentions', type=int, default=500, help='Number of mentions of the document.')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of timed runs of each stage.')
+    parser.add_argument('--seed', type=int, default=42, help='Seed of the synthetic document.')
+    parser.add_argument('--output', help='Path to write the JSON results to (default: stdout).')
+    parser.add_argument('--compare', help='Path of previous JSON results, to report latency ratios against.')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+    results = {
+        'config': {
+            'tokens': args.tokens,
+            'sentences': args.sentences,
+            'mentions': args.mentions,
+            'repeat': args.repeat,
+            'seed': args.seed,
+        },
+        'environment': {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+        },
+        'stages': run(args.tokens, args.sentences, args.mentions, args.repeat, args.seed),
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+    if args.compare:
+        with open(args.compare) as file:
+            results['p50_ratio_to_baseline'] = compare(results, json.load(file))
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+    else:
+        print(output)
@@ -0,0 +1,160 @@
+"""
+Throughput benchmark of the prefork server (coref.serving) on the batch
+ endpoint, for increasing numbers of worker processes, with stand-in models
+ simulating the prediction cost as CPU work (see benchmarks.stubs).
+
+Reports documents per second, latency percentiles, and the speedup and
+ efficiency (speedup per worker) relative to a single worker, as JSON.
+Scaling can't exceed the number of CPU cores, also reported. The trained
+ models' scaling also depends on TF's own threading, which this doesn't measure.
+
+Usage: python -m benchmarks.bench_serving [--workers 1 2 4] [--requests N]
+                                          [--documents-per-request N] [--mentions N] [--row-cost S]
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import logging
+import argparse
+import threading
+import http.client
+import numpy as np
+import application
+import coref.api
+from coref.serving import bind_socket, serve
+from .stubs import StubModel, install_stubs
+
+
+def synthetic_text(num_sentences, num_mentions, words_per_sentence=20, seed=42):
+    """
+    Text with num_mentions single-word manual (bracketed) mentions, at random
+     positions of its sentences.
+    """
+    rng = np.random.RandomState(seed)
+    words = ['w{}'.format(word) for word in np.minimum(rng.zipf(1.5, size=num_sentences * words_per_sentence), 500)]
+    positions = set(rng.choice(len(words), size=min(num_mentions, len(words)), replace=False))
+    sentences = list()
+    for start in range(0, len(words), words_per_sentence):
+        sentence = [
+            '[{}]'.format(words[idx]) if idx in positions else words[idx]
+            for idx in range(start, start + words_per_sentence)
+        ]
+        sentences.append(' '.join(sentence) + '.')
+    return ' '.join(sentences)
+
+
+def start_server(workers, row_cost):
+    """
+    Forks a prefork server with the given number of workers, on a free port.
+    @returns (server pid, port)
+    """
+    sock = bind_socket('127.0.0.1', 0)
+    port = sock.getsockname()[1]
+
+    def preload():
+        for model_key in coref.api.MODEL_KEYS:
+            install_stubs(coref.api.cached_models, model_key, StubModel(row_cost=row_cost, busy_wait=True))
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            serve(application.app, sock, workers=workers, preload=preload)
+        finally:
+            os._exit(0)
+    sock.close()
+
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/api/stats')
+            connection.getresponse().read()
+            return pid, port
+        except (ConnectionError, OSError):
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def stop_server(pid):
+    os.kill(pid, signal.SIGTERM)
+    os.waitpid(pid, 0)
+
+
+def run_clients(port, num_clients, num_requests, documents_per_request, num_mentions, seed_offset):
+    latencies, errors = list(), list()
+    lock = threading.Lock()
+    request_ids = iter(range(num_requests))
+
+    def client():
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=300)
+        while True:
+            with lock:
+                request_id = next(request_ids, None)
+            if request_id is None:
+                return
+            # Distinct documents in every request and run, so the result cache never hits
+            documents = [
+                {'document': synthetic_text(num_mentions // 2, num_mentions,
+                                            seed=seed_offset + request_id * documents_per_request + idx),
+                 'model': 0, 'automaticMentionDetection': False}
+                for idx in range(documents_per_request)
+            ]
+            body = json.dumps({'documents': documents})
+            start = time.monotonic()
+            connection.request('POST', '/api/clusters/batch', body, {'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            response.read()
+            with lock:
+                latencies.append(time.monotonic() - start)
+                if response.status != 200:
+                    errors.append(response.status)
+
+    threads = [threading.Thread(target=client) for _ in range(num_clients)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    assert not errors, 'requests failed with status {}'.format(sorted(set(errors)))
+    return {
+        'documents_per_second': len(latencies) * documents_per_request / elapsed,
+        'latency_p50_ms': 1000 * float(np.percentile(latencies, 50)),
+        'latency_p99_ms': 1000 * float(np.percentile(latencies, 99)),
+    }
+
+
+def parse_args(argv):
+    default_workers = sorted({1, 2, 4, os.cpu_count() or 1})
+    parser = argparse.ArgumentParser(description='Throughput of the prefork server per number of workers.')
+    parser.add_argument('--workers', type=int, nargs='+', default=default_workers)
+    parser.add_argument('--requests', type=int, default=200, help='Number of requests per worker count.')
+    parser.add_argument('--documents-per-request', type=int, default=4)
+    parser.add_argument('--mentions', type=int, default=100, help='Number of mentions per document.')
+    parser.add_argument('--row-cost', type=float, default=2e-6, help='Simulated CPU seconds per mention-pair.')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)   # don't log every request
+    results = {'cpu_count': os.cpu_count(), 'runs': dict()}
+    for run_idx, workers in enumerate(args.workers):
+        pid, port = start_server(workers, args.row_cost)
+        try:
+            run = run_clients(port, 2 * workers, args.requests, args.documents_per_request, args.mentions,
+                              seed_offset=run_idx * args.requests * args.documents_per_request)
+        finally:
+            stop_server(pid)
+        results['runs'][workers] = run
+
+    baseline = results['runs'][args.workers[0]]['documents_per_second'] / args.workers[0]
+    for workers, run in results['runs'].items():
+        run['speedup'] = run['documents_per_second'] / baseline
+        run['efficiency'] = run['speedup'] / workers
+    print(json.dumps(results, indent=2))
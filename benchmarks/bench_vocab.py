@@ -0,0 +1,81 @@
+"""
+Benchmark of the memory-mapped vocabulary (coref.vocab) against the pickled
+ Keras Tokenizer it was converted from: load time, memory allocated by the
+ load, and text to sequence conversion throughput of mention-like texts.
+
+Usage: python -m benchmarks.bench_vocab tokenizer.pkl [num_texts]
+"""
+
+import os
+import sys
+import json
+import time
+import pickle
+import random
+import tempfile
+import tracemalloc
+from coref.vocab import Vocabulary, write_vocabulary
+
+
+def measure_load(load):
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        loaded = load()
+        elapsed = time.perf_counter() - start
+        allocated, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return loaded, elapsed, allocated
+
+
+def mention_texts(words, num_texts, seed=42):
+    rng = random.Random(seed)
+    return [
+        ' '.join(rng.choice(words) for _ in range(rng.randint(1, 4))).title()
+        for _ in range(num_texts)
+    ]
+
+
+def run(tokenizer_path, num_texts=100000):
+    def load_tokenizer():
+        with open(tokenizer_path, 'rb') as file:
+            return pickle.load(file)
+    tokenizer, tokenizer_load, tokenizer_memory = measure_load(load_tokenizer)
+
+    vocabulary_path = os.path.join(tempfile.mkdtemp(), 'tokenizer.vocab')
+    write_vocabulary(tokenizer, vocabulary_path)
+    vocabulary, vocabulary_load, vocabulary_memory = measure_load(lambda: Vocabulary(vocabulary_path))
+
+    texts = mention_texts(sorted(tokenizer.word_index) + ['<unknown>'], num_texts)
+    start = time.perf_counter()
+    expected = tokenizer.texts_to_sequences(texts)
+    tokenizer_elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    sequences = vocabulary.texts_to_sequences(texts)
+    vocabulary_elapsed = time.perf_counter() - start
+    assert sequences == expected, 'vocabulary and tokenizer sequences differ'
+
+    return {
+        'words': len(vocabulary),
+        'pickle_bytes': os.path.getsize(tokenizer_path),
+        'vocabulary_bytes': os.path.getsize(vocabulary_path),
+        'tokenizer': {
+            'load_ms': 1000 * tokenizer_load,
+            'allocated_bytes': tokenizer_memory,
+            'texts_per_second': num_texts / tokenizer_elapsed,
+        },
+        'vocabulary': {
+            'load_ms': 1000 * vocabulary_load,
+            'allocated_bytes': vocabulary_memory,
+            'texts_per_second': num_texts / vocabulary_elapsed,
+        },
+    }
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        print(__doc__.strip().splitlines()[-1])
+        sys.exit(1)
+    num_texts = int(sys.argv[2]) if len(sys.argv) == 3 else 100000
+    print(json.dumps(run(sys.argv[1], num_texts), indent=2))
@@ -0,0 +1,93 @@
+"""
+Load test of the micro-batching scheduler, with concurrent clients scoring
+ small batches of mention-pairs on a stub model with a fixed per-call overhead.
+
+Usage: python -m benchmarks.load_test_scheduler [num_clients] [requests_per_client] [rows_per_request]
+"""
+
+import sys
+import json
+import threading
+import time
+import numpy as np
+from coref.utils import MemCache
+from .stubs import StubModel, install_stubs
+
+
+MODEL_KEY = 'stub'
+
+
+def random_pairs(num_rows, rng):
+    return [
+        rng.randint(0, 100, size=(num_rows, 50)).astype('int32'),
+        rng.randint(0, 100, size=(num_rows, 50)).astype('int32'),
+        rng.randint(0, 10, size=(num_rows, 2)).astype('float32'),
+    ]
+
+
+def run_clients(mem_cache, num_clients, requests_per_client, rows_per_request):
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def client(seed):
+        rng = np.random.RandomState(seed)
+        for _ in range(requests_per_client):
+            X = random_pairs(rows_per_request, rng)
+            start = time.monotonic()
+            predictions = mem_cache.predict(MODEL_KEY, X)
+            elapsed = time.monotonic() - start
+            expected = mem_cache.models[MODEL_KEY].predict(X)
+            with lock:
+                latencies.append(elapsed)
+                if not np.array_equal(predictions, expected):
+                    errors.append(seed)
+
+    threads = [threading.Thread(target=client, args=(seed,)) for seed in range(num_clients)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    assert not errors, 'clients got predictions of other requests'
+    return {
+        'requests_per_second': len(latencies) / elapsed,
+        'pairs_per_second': len(latencies) * rows_per_request / elapsed,
+        'latency_p50_ms': 1000 * np.percentile(latencies, 50),
+        'latency_p99_ms': 1000 * np.percentile(latencies, 99),
+    }
+
+
+class LockedModel(object):
+    """
+    Serializes calls to the wrapped model, as the Keras models aren't thread-safe.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.lock = threading.Lock()
+
+    def predict(self, X):
+        with self.lock:
+            return self.model.predict(X)
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:4]]
+    num_clients, requests_per_client, rows_per_request = args + [32, 20, 50][len(args):]
+    model = StubModel(call_overhead=0.005, row_cost=1e-6)
+
+    direct = MemCache('.')
+    install_stubs(direct, MODEL_KEY, LockedModel(model))
+
+    batched = MemCache('.')
+    install_stubs(batched, MODEL_KEY, model)
+    batched.enable_micro_batching(max_batch_size=8192, max_latency=0.005)
+
+    results = {
+        'direct': run_clients(direct, num_clients, requests_per_client, rows_per_request),
+        'micro_batched': run_clients(batched, num_clients, requests_per_client, rows_per_request),
+        'scheduler': batched.get_scheduler_stats()[MODEL_KEY],
+    }
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,79 @@
+"""
+Deterministic stand-ins for the Keras models, tokenizers and TF graphs, so the
+ pipeline can be benchmarked without the trained models.
+"""
+
+import time
+import zlib
+import numpy as np
+
+
+class StubModel(object):
+    """
+    Stand-in for a mention-pair model, with the same inputs, [X_m1, X_m2, X_scalar],
+     and output, one score per mention-pair in [0, 1].
+    Scores are a deterministic function of the inputs. Optionally sleeps to
+     simulate a fixed per-call overhead and a per-row cost, or busy-waits to
+     simulate them as CPU work.
+    """
+
+    def __init__(self, call_overhead=0., row_cost=0., busy_wait=False):
+        self.call_overhead = call_overhead
+        self.row_cost = row_cost
+        self.busy_wait = busy_wait
+
+    def predict(self, X):
+        X_m1, X_m2, X_scalar = X
+        cost = self.call_overhead + self.row_cost * len(X_m1)
+        if cost and self.busy_wait:
+            deadline = time.perf_counter() + cost
+            while time.perf_counter() < deadline:
+                pass
+        elif cost:
+            time.sleep(cost)
+
+        weights = np.arange(1, X_m1.shape[1] + 1)
+        m1_hash, m2_hash = (X_m1 * weights).sum(axis=1) % 101, (X_m2 * weights).sum(axis=1) % 101
+        same_mention = (m1_hash == m2_hash).astype(np.float32)
+        proximity = 1. / (1. + X_scalar.sum(axis=1))
+        scores = 0.6 * same_mention + 0.3 * proximity + ((m1_hash + m2_hash) % 10) / 100.
+        return scores.astype(np.float32).reshape(-1, 1)
+
+
+class StubTokenizer(object):
+    """
+    Stand-in for a Keras Tokenizer, hashing each word into a fixed vocabulary.
+    """
+
+    def __init__(self, vocabulary_size=20000):
+        self.vocabulary_size = vocabulary_size
+
+    def texts_to_sequences(self, texts):
+        return [
+            [zlib.crc32(word.encode('utf-8')) % (self.vocabulary_size - 1) + 1 for word in text.lower().split()]
+            for text in texts
+        ]
+
+
+class NullGraph(object):
+    """
+    Stand-in for a TF graph, whose as_default() context does nothing.
+    """
+
+    def as_default(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+def install_stubs(mem_cache, model_key, model=None, tokenizer=None):
+    """
+    Registers stand-in model and tokenizer in the given MemCache, under model_key.
+    """
+    mem_cache.models[model_key] = model or StubModel()
+    mem_cache.model_graphs[model_key] = NullGraph()
+    mem_cache.tokenizers[model_key] = tokenizer or StubTokenizer()
@@ -3,11 +3,18 @@ API for coreference resolution services to be exposed by the web server.
 """
 
 import numpy as np
-from .semeval import Document, Mention, MentionPair, Token
-from .data import process_mention_pairs_to_distance_features, process_mention_pairs_to_indices
-from .clustering import cluster_by_closest_antecedent
+from .semeval import Document, Mention, MentionPairs, Token
+from .data import process_mention_pairs_to_distance_features, process_mentions_to_indices
+from .clustering import cluster_by_closest_antecedent, cluster_by_closest_antecedent_lazy
 from .utils import MemCache
+from .cache import ResultCache, normalize_text
+from .sessions import Session, SessionStore
+from .ner import EntityRecognizer
+from . import metrics
 import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 DATA_PATH = os.getenv('DATA_PATH', '../data')
 POLYGLOT_DATA_PATH = os.getenv('POLYGLOT_DATA_PATH', DATA_PATH)
@@ -16,125 +23,591 @@ os.environ['POLYGLOT_DATA_PATH'] = POLYGLOT_DATA_PATH
 from polyglot.downloader import Downloader
 from polyglot.text import Text
 
+logger = logging.getLogger(__name__)
+
+# PT and ES embeddings and NER models, for mention detection
+POLYGLOT_PACKAGES = ['embeddings2.pt', 'embeddings2.es', 'ner2.pt', 'ner2.es']
+polyglot_status = dict()    # package -> 'present', 'downloaded' or 'failed'
+
+def _polyglot_package_path(package):
+    return os.path.join(POLYGLOT_DATA_PATH, 'polyglot_data', *package.split('.'))
+
 def _download_polyglot_data():
+    """
+    Downloads the polyglot packages missing from POLYGLOT_DATA_PATH. Failed
+     downloads (e.g. without network) are logged, not raised, so the server can
+     still start with manual mention detection.
+    """
     downloader = Downloader()
+    for package in POLYGLOT_PACKAGES:
+        if os.path.isdir(_polyglot_package_path(package)):
+            polyglot_status[package] = 'present'
+            continue
+        try:
+            downloaded = downloader.download(package, quiet=True)
+        except Exception as err:
+            logger.warning('Failed to download polyglot package %s: %s', package, err)
+            downloaded = False
+        polyglot_status[package] = 'downloaded' if downloaded is not False else 'failed'
+
+
+MAX_MENTION_LEN = 50
+MODEL_KEYS = ['pt', 'es', 'pt-transferred']
+TOKENIZER_KEYS = ['pt', 'es']
+MENTION_DETECTION_LANGUAGES = ['pt', 'es']
+
+cached_models = MemCache(DATA_PATH, split_models=os.getenv('SPLIT_MODELS', 'false') == 'true')
+if os.getenv('MICRO_BATCHING', 'false') == 'true':
+    cached_models.enable_micro_batching(
+        max_batch_size=int(os.getenv('MICRO_BATCH_SIZE', '8192')),
+        max_latency=float(os.getenv('MICRO_BATCH_LATENCY_MS', '5')) / 1000
+    )
+# Whether to only score distinct mentions and mention-pairs, which pays off for
+# documents with many repeated mentions at the same binned distances
+DEDUPLICATE = os.getenv('DEDUPLICATE_PAIRS', 'false') == 'true'
 
-    # Download PT and ES embeddings for mention detection
-    downloader.download('embeddings2.pt')
-    downloader.download('embeddings2.es')
+STARTUP_MODE = os.getenv('STARTUP_MODE', 'eager')
+startup = {'mode': None, 'status': 'not_started', 'mention_detection': dict()}
+
+def set_up(mode=STARTUP_MODE, shared=True, models=True):
+    """
+    Downloads the missing polyglot data, and loads the tokenizers and models.
+    @arg mode 'eager' loads everything before returning; 'background' returns
+     at once, loading everything in a background thread; 'lazy' only downloads
+     the polyglot data, loading each tokenizer and model on first use.
+     Requests for a model not yet loaded wait for its load, in any mode.
+    @arg shared Whether to load the state which can be shared with forked
+     processes: polyglot data and NER models, and tokenizers.
+    @arg models Whether to load the models. TF sessions don't survive a fork,
+     so prefork servers load them in each worker (see serving.py).
+    """
+    if mode not in ('eager', 'background', 'lazy'):
+        raise ValueError('Unknown startup mode: {}'.format(mode))
+    startup['mode'] = mode
+
+    if mode == 'lazy':
+        _download_polyglot_data()
+        startup['status'] = 'done'
+    elif mode == 'background':
+        kwargs = {'raise_errors': False, 'shared': shared, 'models': models}
+        thread = threading.Thread(target=_load_all, kwargs=kwargs, name='startup')
+        thread.daemon = True
+        thread.start()
+    else:
+        _load_all(shared=shared, models=models)
 
-    # Download NER models
-    downloader.download('ner2.pt')
-    downloader.download('ner2.es')
 
+def _load_all(raise_errors=True, shared=True, models=True):
+    """
+    Downloads the polyglot data and loads the tokenizers in parallel with the
+     models. Models are loaded one after another, as they share the TF graph.
+    A failed load doesn't prevent loading the others.
+    """
+    startup['status'] = 'loading'
+    errors = list()
+    with ThreadPoolExecutor(max_workers=len(TOKENIZER_KEYS) + 1) as executor:
+        futures = list()
+        if shared:
+            futures.append(executor.submit(_download_polyglot_data))
+            futures += [executor.submit(cached_models.get_tokenizer, key) for key in TOKENIZER_KEYS]
 
-cached_models = MemCache(DATA_PATH)
-def set_up():
-    # Download data for NER with polyglot
-    _download_polyglot_data()
+        if models:
+            logger.info('Loading models...')
+        for key in MODEL_KEYS if models else []:
+            try:
+                cached_models.get_model(key)
+            except Exception as err:
+                logger.exception('Failed to load model %s.', key)
+                errors.append(err)
+        for future in futures:
+            if future.exception() is not None:
+                logger.error('Failed to load: %s', future.exception())
+                errors.append(future.exception())
 
-    # Load tokenizers to memory
-    print('Loading tokenizers...')
-    _, _ = cached_models.get_tokenizer('pt'), cached_models.get_tokenizer('es')
+    if shared:
+        _warm_up_mention_detection()
+    startup['status'] = 'failed' if errors else 'done'
+    if errors and raise_errors:
+        raise errors[0]
 
-    # Load models to memory
-    print('Loading models...')
-    _, _, _ = cached_models.get_model('pt'), cached_models.get_model('es'), cached_models.get_model('pt-transferred')
+
+def _warm_up_mention_detection():
+    """
+    Loads polyglot's embeddings and NER models (cached on first use) for each
+     language, by detecting the mentions of a short text.
+    """
+    for language in MENTION_DETECTION_LANGUAGES:
+        try:
+            automatic_mention_detection('Lisboa e Madrid.', language)
+            startup['mention_detection'][language] = 'loaded'
+        except Exception as err:
+            logger.warning('Failed to load mention detection for %s: %s', language, err)
+            startup['mention_detection'][language] = 'failed'
+
+
+def readiness():
+    """
+    Startup progress: the polyglot data's, tokenizers' and models' status.
+    The service is ready once everything is loaded, or at once in lazy mode.
+    """
+    status = cached_models.get_status(TOKENIZER_KEYS, MODEL_KEYS)
+    status['mode'] = startup['mode']
+    status['startup'] = startup['status']
+    status['polyglot_data'] = dict(polyglot_status)
+    status['mention_detection'] = dict(startup['mention_detection'])
+    status['ready'] = startup['status'] == 'done' and (startup['mode'] == 'lazy' or all(
+        value == 'loaded' for value in list(status['tokenizers'].values()) + list(status['models'].values())
+    ))
+    return status
+
+
+# Version of the serialized results' format, part of their cache keys, so that
+# results persisted in an older format (see RESULT_CACHE_DB) aren't served
+RESULT_FORMAT = 3
+
+result_cache = ResultCache(
+    max_entries=int(os.getenv('RESULT_CACHE_SIZE', '1024')),
+    max_bytes=int(os.getenv('RESULT_CACHE_MAX_MB', '64')) * 2**20,
+    ttl=float(os.getenv('RESULT_CACHE_TTL')) if os.getenv('RESULT_CACHE_TTL') else None,
+    db_path=os.getenv('RESULT_CACHE_DB'),
+    max_db_entries=int(os.getenv('RESULT_CACHE_DB_SIZE', '100000'))
+)
+
+session_store = SessionStore(
+    max_bytes=int(os.getenv('SESSIONS_MAX_MB', '256')) * 2**20,
+    idle_timeout=float(os.getenv('SESSION_IDLE_TIMEOUT', '1800'))
+)
+
+entity_recognizer = EntityRecognizer(
+    num_workers=int(os.getenv('NER_WORKERS', '0')),
+    cache_size=int(os.getenv('NER_CACHE_SIZE', '10000')),
+    min_parallel_words=int(os.getenv('NER_MIN_PARALLEL_WORDS', '2000'))
+)
+
+
+def _stat_metric(prefix, stat, gauges, description, samples):
+    """
+    The given statistic as a collected metric: a gauge if among gauges, else a
+     counter, named with the '_total' suffix.
+    """
+    description = description.format(stat.replace('_', ' '))
+    if stat in gauges:
+        return prefix + stat, 'gauge', description, samples
+    return prefix + stat + '_total', 'counter', description, samples
+
+
+def _collect_stats():
+    """
+    Exports the result cache's, models', schedulers' and mention detection's
+     statistics as metrics.
+    """
+    cache_stats = result_cache.get_stats()
+    ner_stats = entity_recognizer.get_stats()
+    model_stats = {key: cached_models.get_stats(key) for key in list(cached_models.models)}
+    scheduler_stats = cached_models.get_scheduler_stats()
+    return [
+        _stat_metric('coref_result_cache_', stat, ('entries', 'bytes'), 'Result cache {}.', [({}, value)])
+        for stat, value in sorted(cache_stats.items())
+    ] + [
+        _stat_metric('coref_model_', stat, ('dedup_ratio',), 'Model prediction {}.',
+                     [({'model': key}, stats[stat]) for key, stats in sorted(model_stats.items())])
+        for stat in ('calls', 'rows', 'predicted_rows', 'dedup_ratio') if model_stats
+    ] + [
+        _stat_metric('coref_scheduler_', stat, ('queue_depth', 'max_queue_depth', 'mean_batch_rows', 'max_batch_rows'),
+                     'Micro-batching scheduler {}.',
+                     [({'model': key}, stats[stat]) for key, stats in sorted(scheduler_stats.items())])
+        for stat in ('requests', 'batches', 'rows', 'queue_depth', 'max_queue_depth',
+                     'mean_batch_rows', 'max_batch_rows') if scheduler_stats
+    ] + [
+        _stat_metric('coref_ner_', stat, ('cached_sentences',), 'Mention detection {}.', [({}, value)])
+        for stat, value in sorted(ner_stats.items())
+    ]
+
+metrics.registry.add_collector(_collect_stats)
 
 
 def automatic_mention_detection(text, hint_language_code):
     """
     Returns a Document object whose mentions automatically detected.
+    Entities are recognized by entity_recognizer, in parallel for long texts.
     """
     doc = Document('user-defined-document')
+    doc.text = text
 
     text_obj = Text(text, hint_language_code=hint_language_code)
     for sentence_idx, sentence in enumerate(text_obj.sentences):
         for token_idx, token in enumerate(sentence.tokens):
             t = Token([token_idx, token.string], sentence_idx)
             doc.add_token(t)
+    offsets = _char_offsets(text, [token.get_string() for token in doc.tokens])
 
-    for mention in text_obj.entities:
-        toks = doc.tokens[mention.start: mention.end]
-        doc.mentions.append(Mention(toks))
+    for start, end, _ in entity_recognizer.entities(text_obj):
+        toks = doc.tokens[start: end]
+        mention = Mention(toks)
+        mention.char_span = _char_span(offsets, start, end)
+        doc.mentions.append(mention)
 
     return doc
 
 
-def parse_manual_mentions(text):
+class MentionSyntaxError(ValueError):
+    """
+    Raised for malformed manual mention annotations, at the given character
+     position of the text.
+    """
+
+    def __init__(self, message, position):
+        super(MentionSyntaxError, self).__init__('{} at character {}.'.format(message, position))
+        self.position = position
+
+
+def _char_offsets(text, strings):
+    """
+    Character offsets (start, end) of each of the given strings, searched for
+     in order in the text (as its tokens), or None for those not found.
+    """
+    offsets, position = list(), 0
+    for string in strings:
+        start = text.find(string, position)
+        if start < 0:
+            offsets.append(None)
+            continue
+        position = start + len(string)
+        offsets.append((start, position))
+    return offsets
+
+
+def _char_span(offsets, start, end):
+    """
+    Character span of the tokens [start, end), given each token's offsets.
     """
-    Returns a Document object whose mentions were manually separated
-     with a given character.
-    """
-    def get_mention_tokens(start_idx, tokens):
-        mention_tokens = list()
-        nested_mentions = 1
-        tokens[start_idx].num_mention_starts -= 1
-        print('Searching mention starting at {}: {}'.format(start_idx, tokens[start_idx].get_string()))
-        for i in range(start_idx, len(tokens)):
-            print('Token {}. Starts: {}. Ends: {}.'.format(tokens[i].get_string(), tokens[i].num_mention_starts, tokens[i].num_mention_ends))
-            nested_mentions += tokens[i].num_mention_starts
-            if tokens[i].num_mention_ends > 0:
-                nested_mentions -= tokens[i].num_mention_ends
-                if nested_mentions <= 0:
-                    tokens[i].num_mention_ends -= 1
-                    return tokens[start_idx: i+1]
-
-        raise RuntimeWarning("Didn't find match for token at index {}: '{}'".format(start_idx, tokens[start_idx].get_string()))
+    if offsets[start] is None or offsets[end - 1] is None:
+        return None
+    return offsets[start][0], offsets[end - 1][1]
 
+
+def parse_manual_mentions(text):
+    """
+    Returns a Document object whose mentions were manually delimited with
+     square brackets, possibly nested, in a single pass with a stack of open
+     mentions.
+    Mentions are ordered by first token, and longest first for the same token.
+    Raises MentionSyntaxError for unbalanced or empty brackets.
+    """
     doc = Document('user-defined-document')
+    doc.text = text
 
     text_obj = Text(text)
+    sentence_tokens = [
+        (sentence_idx, token.string)
+        for sentence_idx, sentence in enumerate(text_obj.sentences) for token in sentence.tokens
+    ]
+    offsets = _char_offsets(text, [string for _, string in sentence_tokens])
 
-    # Extract tokens
-    for sentence_idx, sentence in enumerate(text_obj.sentences):
-        token_count = 0
-        next_is_start = 0 # Counts the number of mentions starting at the next token
-        for idx, token in enumerate(sentence.tokens):
-            print(sentence_idx, token_count, token.string)
-            if token.string == '[':
-                next_is_start += 1
-            elif token.string == ']':
-                doc.tokens[-1].num_mention_ends += 1
-            else:
-                t = Token([token_count, token.string], sentence_idx)
-                t.num_mention_starts = next_is_start
-                next_is_start = 0
-
-                doc.add_token(t)
-                token_count += 1
-
-    # Extract mentions
-    for tok_idx, token in enumerate(doc.tokens):
-        num_mention_starts = token.num_mention_starts
-        for _ in range(num_mention_starts):
-            mention_tokens = get_mention_tokens(tok_idx, doc.tokens)
-            doc.mentions.append(Mention(mention_tokens))
+    token_offsets = list()  # character offsets of each of the document's tokens
+    open_mentions = list()  # (first token, '[' offset) of each open mention, innermost last
+    spans = list()          # (first token, end token) of each mention
+    token_count, prev_sentence_idx = 0, None
+    for (sentence_idx, string), offset in zip(sentence_tokens, offsets):
+        position = offset[0] if offset is not None else '?'
+        if string == '[':
+            open_mentions.append((len(doc.tokens), position))
+        elif string == ']':
+            if not open_mentions:
+                raise MentionSyntaxError("Unmatched ']'", position)
+            start, start_position = open_mentions.pop()
+            if start == len(doc.tokens):
+                raise MentionSyntaxError("Empty mention '[]'", start_position)
+            spans.append((start, len(doc.tokens)))
+        else:
+            if sentence_idx != prev_sentence_idx:
+                token_count, prev_sentence_idx = 0, sentence_idx
+            doc.add_token(Token([token_count, string], sentence_idx))
+            token_offsets.append(offset)
+            token_count += 1
+
+    if open_mentions:
+        raise MentionSyntaxError("Unmatched '['", open_mentions[0][1])
 
+    spans.sort(key=lambda span: (span[0], -span[1]))
+    for start, end in spans:
+        mention = Mention(doc.tokens[start: end])
+        mention.char_span = _char_span(token_offsets, start, end)
+        doc.mentions.append(mention)
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('Parsed %d tokens and %d mentions.', len(doc.tokens), len(doc.mentions))
     return doc
 
 
-def cluster_mentions(doc, language):
-    MAX_MENTION_LEN = 50
-    def process_mention_pairs(mps, tokenizer):
-        X_m1, X_m2 = process_mention_pairs_to_indices(mps, tokenizer, MAX_MENTION_LEN)
+def is_true(value):
+    return str(value).lower() == 'true'
+
+
+class InvalidOptionError(ValueError):
+    """
+    Raised for invalid or conflicting request options.
+    """
+
+
+def _int_option(fields, name):
+    try:
+        return int(fields[name])
+    except (TypeError, ValueError):
+        raise InvalidOptionError("Option {} must be an integer, got '{}'.".format(name, fields[name]))
+
+
+def pair_options(fields):
+    """
+    Optional mention-pair generation parameters, limiting the antecedents
+     considered for each mention, or scoring them lazily (see cluster_mentions),
+     from a request's fields (form or JSON).
+    Raises InvalidOptionError for invalid or conflicting options.
+    """
+    options = dict()
+    if fields.get('maxAntecedentDistance'):
+        options['max_mention_distance'] = _int_option(fields, 'maxAntecedentDistance')
+    if fields.get('maxSentenceDistance'):
+        options['max_sentence_distance'] = _int_option(fields, 'maxSentenceDistance')
+    if fields.get('keepStringMatches') is not None:
+        options['keep_string_matches'] = is_true(fields['keepStringMatches'])
+    if is_true(fields.get('lazy', False)):
+        if options:
+            raise InvalidOptionError('Option lazy considers all antecedents, it can\'t be combined with '
+                                     'maxAntecedentDistance, maxSentenceDistance or keepStringMatches.')
+        options['lazy'] = True
+    return options
+
+
+def parse_document(text, model_key, automatic):
+    """
+    Returns a Document object whose mentions were either detected automatically,
+     in the model's language, or manually separated with brackets.
+    """
+    with metrics.timed('tokenize_ner'):
+        if automatic:
+            return automatic_mention_detection(text, 'es' if model_key == 'es' else 'pt')
+        return parse_manual_mentions(text)
+
+
+def featurize_document(doc, language, **pair_options):
+    """
+    Generates the document's mention-pairs and processes them into the model's
+     inputs: each mention's token indices, and each pair's distance features.
+    @arg pair_options Options for Document.generate_mention_pairs (e.g.
+     max_mention_distance, max_sentence_distance, keep_string_matches).
+    @returns (mention_pairs, X_mentions, X_scalar)
+    """
+    tokenizer = cached_models.get_tokenizer(language)
+    sequence_cache = cached_models.get_sequence_cache(language)
+
+    with metrics.timed('pair_generation'):
+        mps = doc.generate_mention_pairs(**pair_options)
+    with metrics.timed('featurization'):
+        X_mentions = process_mentions_to_indices(doc.mentions, tokenizer, MAX_MENTION_LEN, sequence_cache)
         X_scalar = process_mention_pairs_to_distance_features(mps)
-        return [X_m1, X_m2, X_scalar]
+    metrics.record_document(len(doc.mentions), len(mps))
+    return mps, X_mentions, X_scalar
 
+
+def pair_scorer(doc, language, deduplicate=DEDUPLICATE):
+    """
+    Returns a function scoring any of the document's mention-pairs, given as
+     (m1_idx, m2_idx) arrays, encoding the document's mentions only once.
+    The number of mention-pairs scored so far is kept in its num_pairs attribute.
+    """
     tokenizer = cached_models.get_tokenizer(language)
+    sequence_cache = cached_models.get_sequence_cache(language)
+    with metrics.timed('featurization'):
+        X_mentions = process_mentions_to_indices(doc.mentions, tokenizer, MAX_MENTION_LEN, sequence_cache)
+    with metrics.timed('predict'):
+        mention_inputs = cached_models.encode_mentions(language, X_mentions, deduplicate)
+
+    def score_pairs(m1_idx, m2_idx):
+        with metrics.timed('featurization'):
+            X_scalar = process_mention_pairs_to_distance_features(MentionPairs(doc, m1_idx, m2_idx))
+        with metrics.timed('predict'):
+            predictions = cached_models.score_pairs(language, mention_inputs, m1_idx, m2_idx, X_scalar, deduplicate)
+        score_pairs.num_pairs += len(m1_idx)
+        return predictions
+
+    score_pairs.num_pairs = 0
+    return score_pairs
+
+
+def cluster_mentions(doc, language, deduplicate=DEDUPLICATE, lazy=False, **pair_options):
+    """
+    Clusters the given document's mentions with the given language's model.
+    @arg deduplicate Whether to only score distinct feature rows (repeated surface
+     forms at the same binned distances yield identical rows).
+    @arg lazy Whether to score antecedents nearest first, only until each mention
+     is linked (see cluster_by_closest_antecedent_lazy). Same clusters as the
+     default, with all antecedents.
+    @arg pair_options Options for Document.generate_mention_pairs, limiting the
+     antecedents considered for each mention.
+    """
+    if lazy:
+        if pair_options:
+            raise InvalidOptionError(
+                'Lazy scoring considers all antecedents, got pair options: {}'.format(pair_options))
+        score_pairs = pair_scorer(doc, language, deduplicate)
+        clusters = cluster_by_closest_antecedent_lazy(doc, score_pairs)
+        metrics.record_document(len(doc.mentions), score_pairs.num_pairs)
+        return clusters
+
+    mps, X_mentions, X_scalar = featurize_document(doc, language, **pair_options)
+    with metrics.timed('predict'):
+        predictions = cached_models.predict_pairs(language, X_mentions, mps.m1_idx, mps.m2_idx, X_scalar, deduplicate)
+
+    if logger.isEnabledFor(logging.DEBUG):
+        for idx, (i1, i2) in enumerate(zip(mps.m1_idx, mps.m2_idx)):
+            logger.debug('MP at index %d: %s : %s. PRED: %s. Features: %s %s %s', idx,
+                         doc.mentions[i1].full_mention, doc.mentions[i2].full_mention,
+                         predictions[idx], X_mentions[i1], X_mentions[i2], X_scalar[idx])
+
+    return cluster_by_closest_antecedent(doc, predictions)
+
+
+def cluster_documents(docs, model_keys, deduplicate=DEDUPLICATE, pair_options=None):
+    """
+    Clusters the mentions of each of the given documents, with the respective
+     model. All documents' mention-pairs for the same model are scored in a
+     single prediction.
+    @arg pair_options Optional list with each document's options for
+     Document.generate_mention_pairs, or {'lazy': True} for documents scored
+     lazily, on their own (see cluster_mentions).
+    @returns list with each document's clusters
+    """
+    pair_options = pair_options or [dict() for _ in docs]
+    clusters = [None] * len(docs)
+    batched = list()
+    for idx, options in enumerate(pair_options):
+        options = dict(options)
+        if options.pop('lazy', False):
+            clusters[idx] = cluster_mentions(docs[idx], model_keys[idx], deduplicate, lazy=True, **options)
+        else:
+            batched.append((idx, options))
+
+    features = [featurize_document(docs[idx], model_keys[idx], **options) for idx, options in batched]
+    predictions = predict_documents(
+        [docs[idx] for idx, _ in batched], features, [model_keys[idx] for idx, _ in batched], deduplicate)
+    for (idx, _), doc_predictions in zip(batched, predictions):
+        clusters[idx] = cluster_by_closest_antecedent(docs[idx], doc_predictions)
+    return clusters
+
+
+def predict_documents(docs, features, model_keys, deduplicate=DEDUPLICATE):
+    """
+    Scores the mention-pairs of each of the given documents, given their
+     features (see featurize_document), with the respective model. All
+     documents' mention-pairs for the same model are scored in a single
+     prediction.
+    @returns list with each document's predictions
+    """
+    predictions = [None] * len(docs)
+    for model_key in sorted(set(model_keys)):
+        doc_indices = [idx for idx, key in enumerate(model_keys) if key == model_key]
+        mention_offsets = np.cumsum([0] + [len(docs[idx].mentions) for idx in doc_indices])
+
+        X_mentions = np.concatenate([features[idx][1] for idx in doc_indices])
+        X_scalar = np.concatenate([features[idx][2] for idx in doc_indices])
+        m1_idx = np.concatenate([features[idx][0].m1_idx + offset for idx, offset in zip(doc_indices, mention_offsets)])
+        m2_idx = np.concatenate([features[idx][0].m2_idx + offset for idx, offset in zip(doc_indices, mention_offsets)])
+
+        with metrics.timed('predict'):
+            model_predictions = cached_models.predict_pairs(model_key, X_mentions, m1_idx, m2_idx, X_scalar, deduplicate)
+        pair_offsets = np.cumsum([len(features[idx][0]) for idx in doc_indices])[:-1]
+        for idx, doc_predictions in zip(doc_indices, np.split(model_predictions, pair_offsets)):
+            predictions[idx] = doc_predictions
+
+    return predictions
+
+
+def serialize_clusters(doc, clusters):
+    """
+    JSON serializable representation of the document's mentions, their
+     character spans in the document's text, the text itself (normalized, see
+     cache.normalize_text), and clusters.
+    """
+    with metrics.timed('serialization'):
+        # Convert sets to lists, and numpy.int to native integers, in order to be JSON serializable
+        clusters = [[int(i) for i in c] for c in clusters]
+
+        # Clusters' order is from last to first
+        clusters.reverse()
+
+        return {
+            'mentions': [m.full_mention for m in doc.mentions],
+            'offsets': [list(m.char_span) if m.char_span is not None else None for m in doc.mentions],
+            'text': doc.text,
+            'clusters': clusters
+        }
+
+
+def resolve_texts(texts, model_keys, automatic, pair_options=None):
+    """
+    Resolves the coreferences of each of the given texts, returning their
+     serialized mentions and clusters (see serialize_clusters).
+    Texts are normalized (see cache.normalize_text), and results are cached by
+     normalized text, model and parsing options. Cache misses are clustered
+     together (see cluster_documents).
+    @arg automatic List with each text's mention detection mode.
+    @arg pair_options Optional list with each text's options for
+     Document.generate_mention_pairs.
+    """
+    pair_options = pair_options or [dict() for _ in texts]
+    texts = [normalize_text(text) for text in texts]
+    keys = [
+        ResultCache.key(RESULT_FORMAT, text, model_key, bool(auto), options)
+        for text, model_key, auto, options in zip(texts, model_keys, automatic, pair_options)
+    ]
+
+    results = [result_cache.get(key) for key in keys]
+    misses = [idx for idx, result in enumerate(results) if result is None]
+    if misses:
+        docs = [parse_document(texts[idx], model_keys[idx], automatic[idx]) for idx in misses]
+        clusters = cluster_documents(
+            docs, [model_keys[idx] for idx in misses], pair_options=[pair_options[idx] for idx in misses])
+        for idx, doc, doc_clusters in zip(misses, docs, clusters):
+            results[idx] = serialize_clusters(doc, doc_clusters)
+            result_cache.put(keys[idx], results[idx])
+
+    return results
+
+
+def create_session(model_key, automatic):
+    """
+    Creates an incremental coreference session (see sessions.Session).
+    @returns the session's id
+    """
+    return session_store.add(Session(cached_models, model_key, automatic, MAX_MENTION_LEN, deduplicate=DEDUPLICATE))
+
+
+def append_to_session(session_id, text):
+    """
+    Appends the given text, as new sentences, to the given session, scoring
+     only the pairs of its new mentions.
+    Raises sessions.SessionNotFound if the session doesn't exist or was evicted.
+    @returns the session's serialized mentions and clusters
+    """
+    session = session_store.get(session_id)
+    with session.lock:
+        fragment = parse_document(normalize_text(text), session.model_key, session.automatic)
+        session.append(fragment)
+        result = session.serialize()
+    session_store.update(session_id)
+    return result
+
+
+def get_session(session_id):
+    """
+    Raises sessions.SessionNotFound if the session doesn't exist or was evicted.
+    @returns the session's serialized mentions and clusters
+    """
+    session = session_store.get(session_id)
+    with session.lock:
+        return session.serialize()
+
 
-    mps = doc.generate_mention_pairs()
-    X = process_mention_pairs(mps, tokenizer)
-    predictions = cached_models.predict(language, X)
-
-    print('\nPredictions:\n')
-    for idx, mp in enumerate(mps):
-        print('\nMP at index {}\n'.format(idx))
-        print('\t{} : {}\n'.format(mp.m1.full_mention, mp.m2.full_mention))
-        print('\tPRED: {}\n'.format(predictions[idx]))
-        print(X[0][idx], X[1][idx], X[2][idx])
-        print('\n')
-
-    clusters = cluster_by_closest_antecedent(doc, predictions)
-    
-    return clusters
\ No newline at end of file
+def delete_session(session_id):
+    session_store.remove(session_id)
@@ -0,0 +1,218 @@
+"""
+bulk.py: offline coreference resolution of JSONL documents, for backfills.
+
+Each input line is a JSON object with the same fields as the batch endpoint's
+ documents (document, model, automaticMentionDetection and the pair options),
+ and an optional id. Each output line holds the id (default: the input line
+ number) and the document's mentions, offsets and clusters (as /api/clusters),
+ or an error for invalid documents.
+
+Mention detection and featurization run in a pool of worker processes, which
+ fork after loading the shared polyglot data and tokenizers. The mention-pairs
+ of each batch of documents are scored with one prediction per model, in the
+ main process. Output is checkpointed after each batch, so an interrupted run
+ resumes after the last written batch.
+
+Usage: python -m coref.bulk input.jsonl output.jsonl [--workers N] [--batch-size N]
+                            [--restart] [--progress-interval S]
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import itertools
+from . import api
+from .cache import normalize_text
+from .clustering import cluster_by_closest_antecedent
+from .utils import bounded_imap
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_SUFFIX = '.checkpoint'
+
+
+def model_key(value):
+    """
+    The model key of a document's model field: a key, or its index in MODEL_KEYS.
+    """
+    if value in api.MODEL_KEYS:
+        return value
+    return api.MODEL_KEYS[int(value)]
+
+
+def prepare_document(numbered_line):
+    """
+    Parses (with mention detection) and featurizes the given input line's
+     document. Runs in the pool's worker processes.
+    @returns (line number, id, model key, document, features, error message)
+    """
+    line_number, line = numbered_line
+    record_id = line_number
+    try:
+        record = json.loads(line)
+        record_id = record.get('id', line_number)
+        key = model_key(record.get('model', 0))
+        automatic = api.is_true(record.get('automaticMentionDetection', False))
+        doc = api.parse_document(normalize_text(record['document']), key, automatic)
+        options = api.pair_options(record)
+        # Lazily scored documents are featurized while clustered, in the main process
+        features = None if options.pop('lazy', False) else api.featurize_document(doc, key, **options)
+    except (ValueError, KeyError, IndexError, TypeError, AttributeError) as err:
+        return line_number, record_id, None, None, None, '{}: {}'.format(type(err).__name__, err)
+    return line_number, record_id, key, doc, features, None
+
+
+def resolve_batch(batch):
+    """
+    Clusters the given prepared documents (see prepare_document), scoring the
+     mention-pairs of all documents of the same model in a single prediction,
+     but for lazily scored documents (without features), clustered on their own.
+    @returns list with each document's output record
+    """
+    _, _, keys, docs, features, errors = zip(*batch)
+    prepared = [idx for idx, error in enumerate(errors) if error is None and features[idx] is not None]
+    predictions = api.predict_documents(
+        [docs[idx] for idx in prepared], [features[idx] for idx in prepared], [keys[idx] for idx in prepared])
+    results = {
+        idx: api.serialize_clusters(docs[idx], cluster_by_closest_antecedent(docs[idx], doc_predictions))
+        for idx, doc_predictions in zip(prepared, predictions)
+    }
+
+    records = list()
+    for idx, (_, record_id, _, _, _, error) in enumerate(batch):
+        if error is not None:
+            records.append({'id': record_id, 'error': error})
+        elif idx in results:
+            records.append(dict(results[idx], id=record_id))
+        else:
+            clusters = api.cluster_mentions(docs[idx], keys[idx], lazy=True)
+            records.append(dict(api.serialize_clusters(docs[idx], clusters), id=record_id))
+    return records
+
+
+def _batches(items, batch_size):
+    batch = list()
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = list()
+    if batch:
+        yield batch
+
+
+def read_checkpoint(checkpoint_path, input_path):
+    """
+    The progress of a previous run over the same input: the number of input
+     lines processed, and the size of the output written for them.
+    """
+    if not os.path.exists(checkpoint_path):
+        return {'lines': 0, 'output_bytes': 0, 'documents': 0, 'errors': 0}
+    with open(checkpoint_path) as file:
+        checkpoint = json.load(file)
+    if checkpoint.get('input') != os.path.abspath(input_path):
+        raise ValueError('Checkpoint {} is of another input file, {} (use --restart to start over).'
+                         .format(checkpoint_path, checkpoint.get('input')))
+    return checkpoint
+
+
+def write_checkpoint(checkpoint_path, checkpoint):
+    """
+    Replaces the checkpoint atomically, so an interruption leaves either the
+     previous or the new one.
+    """
+    temp_path = checkpoint_path + '.tmp'
+    with open(temp_path, 'w') as file:
+        json.dump(checkpoint, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, checkpoint_path)
+
+
+def run(input_path, output_path, workers=0, batch_size=64, restart=False, progress_interval=10.):
+    """
+    Resolves the documents of the input JSONL file into the output JSONL file,
+     resuming from its checkpoint unless restarting.
+    @returns the run's statistics
+    """
+    checkpoint_path = output_path + CHECKPOINT_SUFFIX
+    if restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    checkpoint = read_checkpoint(checkpoint_path, input_path)
+    checkpoint['input'] = os.path.abspath(input_path)
+    if checkpoint['lines']:
+        logger.info('Resuming after line %d of %s.', checkpoint['lines'], input_path)
+
+    # Shared state, loaded before forking the workers; models are loaded by this
+    # process on first use, after forking (TF sessions don't survive a fork)
+    api.set_up('eager', models=False)
+
+    start, last_report = time.monotonic(), time.monotonic()
+    num_documents, num_errors = 0, 0
+    with open(input_path, encoding='utf-8') as input_file, \
+            open(output_path, 'r+b' if os.path.exists(output_path) else 'wb') as output_file:
+        # Drop any output written after the last checkpoint
+        output_file.truncate(checkpoint['output_bytes'])
+        output_file.seek(checkpoint['output_bytes'])
+
+        lines = (
+            (line_number, line)
+            for line_number, line in enumerate(itertools.islice(input_file, checkpoint['lines'], None),
+                                               checkpoint['lines'] + 1)
+            if line.strip()
+        )
+        prepared = bounded_imap(prepare_document, lines, workers=workers, window=batch_size + 2 * workers)
+
+        for batch in _batches(prepared, batch_size):
+            records = resolve_batch(batch)
+            output_file.write(''.join(json.dumps(record) + '\n' for record in records).encode('utf-8'))
+            output_file.flush()
+            os.fsync(output_file.fileno())
+
+            num_documents += len(records)
+            batch_errors = sum(1 for record in records if 'error' in record)
+            num_errors += batch_errors
+            checkpoint.update(lines=batch[-1][0], output_bytes=output_file.tell(),
+                              documents=checkpoint['documents'] + len(records),
+                              errors=checkpoint['errors'] + batch_errors)
+            write_checkpoint(checkpoint_path, checkpoint)
+
+            if time.monotonic() - last_report >= progress_interval:
+                last_report = time.monotonic()
+                logger.info('%d documents (%d errors), %.1f docs/s.',
+                            num_documents, num_errors, num_documents / (last_report - start))
+
+    elapsed = time.monotonic() - start
+    stats = {
+        'documents': num_documents,
+        'errors': num_errors,
+        'elapsed_s': elapsed,
+        'documents_per_second': num_documents / elapsed if elapsed else None,
+        'total_documents': checkpoint['documents'],
+        'total_errors': checkpoint['errors'],
+    }
+    logger.info('Done: %d documents (%d errors), %.1f docs/s.', num_documents, num_errors,
+                stats['documents_per_second'] or 0.)
+    return stats
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Resolves the coreferences of a JSONL file of documents.')
+    parser.add_argument('input', help='JSONL file, one {"document": ..., "model": ...} object per line.')
+    parser.add_argument('output', help='JSONL file of results, in the input\'s order.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Worker processes for mention detection and featurization (0 for none).')
+    parser.add_argument('--batch-size', type=int, default=64, help='Documents per prediction and checkpoint.')
+    parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint, starting over.')
+    parser.add_argument('--progress-interval', type=float, default=10., help='Seconds between progress reports.')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper())
+    args = parse_args(sys.argv[1:])
+    stats = run(args.input, args.output, args.workers, args.batch_size, args.restart, args.progress_interval)
+    print(json.dumps(stats, indent=2))
@@ -0,0 +1,159 @@
+"""
+cache.py: content-addressed cache of coreference results.
+"""
+
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize_text(text):
+    """
+    Normalizes the given text's unicode composition and horizontal whitespace.
+    Line breaks are kept, as they delimit sentences.
+    """
+    text = unicodedata.normalize('NFC', text).replace('\r\n', '\n')
+    text = re.sub(r'[^\S\n]+', ' ', text)
+    return re.sub(r' ?\n ?', '\n', text).strip()
+
+
+class ResultCache(object):
+    """
+    LRU cache of serialized results, bounded by number of entries and total
+     size, with an optional time-to-live and an optional on-disk (sqlite) tier
+     which survives restarts, bounded by number of rows.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=64 * 2**20, ttl=None, db_path=None, max_db_entries=100000):
+        """
+        @arg ttl Seconds after which entries expire, or None.
+        @arg db_path Path of the sqlite database for the on-disk tier, or None.
+        @arg max_db_entries Number of rows of the on-disk tier, beyond which the
+         oldest ones are deleted. Checked every 1% of it written rows, as
+         several processes may share the database.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        self.entries = OrderedDict()    # key -> (serialized result, creation time)
+        self.num_bytes = 0
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0, 'disk_evictions': 0}
+
+        self.db_path = db_path
+        self.max_db_entries = max_db_entries
+        self.db, self.db_pid = None, None
+        self.db_lock = threading.Lock()     # held while using the connection, separately from the entries
+        self.db_writes = 0                  # rows written since the last trim
+        if db_path is not None:
+            db = self._connection()
+            db.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, result TEXT, created REAL)')
+            db.execute('CREATE INDEX IF NOT EXISTS results_created ON results (created)')
+            self._trim_db(db)
+            db.commit()
+
+    def _connection(self):
+        """
+        The sqlite connection of the current process, as connections can't be
+         used across a fork (see serving.py).
+        """
+        if self.db is None or self.db_pid != os.getpid():
+            self.db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self.db_pid = os.getpid()
+        return self.db
+
+    @staticmethod
+    def key(*parts):
+        """
+        Content address of a result, from the (JSON serializable) request parts.
+        """
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self._is_expired(entry[1]):
+                self._remove(key)
+                entry = None
+
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return json.loads(entry[0])
+
+        # Disk reads and writes don't hold the entries' lock, so that lookups
+        # of other results don't wait on them
+        row = None
+        if self.db_path is not None:
+            with self.db_lock:
+                row = self._connection().execute('SELECT result, created FROM results WHERE key = ?', (key,)).fetchone()
+
+        with self.lock:
+            if row is not None and not self._is_expired(row[1]):
+                self._insert(key, row[0], row[1])
+                self.stats['disk_hits'] += 1
+                return json.loads(row[0])
+
+            self.stats['misses'] += 1
+            return None
+
+    def put(self, key, result):
+        serialized = json.dumps(result)
+        created = time.time()
+        with self.lock:
+            self._insert(key, serialized, created)
+
+        if self.db_path is not None:
+            with self.db_lock:
+                db = self._connection()
+                db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?)', (key, serialized, created))
+                self.db_writes += 1
+                if self.db_writes >= max(self.max_db_entries // 100, 1):
+                    self._trim_db(db)
+                db.commit()
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self.entries)
+            stats['bytes'] = self.num_bytes
+        return stats
+
+    def _trim_db(self, db):
+        """
+        Deletes the on-disk tier's expired rows, and its oldest rows beyond
+         max_db_entries. Called holding db_lock, or on initialization.
+        """
+        if self.ttl is not None:
+            db.execute('DELETE FROM results WHERE created < ?', (time.time() - self.ttl,))
+        num_excess = db.execute('SELECT COUNT(*) FROM results').fetchone()[0] - self.max_db_entries
+        if num_excess > 0:
+            db.execute('DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY created LIMIT ?)',
+                       (num_excess,))
+            with self.lock:
+                self.stats['disk_evictions'] += num_excess
+        self.db_writes = 0
+
+    def _is_expired(self, created):
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def _insert(self, key, serialized, created):
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = (serialized, created)
+        self.num_bytes += len(serialized)
+
+        while self.entries and (len(self.entries) > self.max_entries or self.num_bytes > self.max_bytes):
+            self._remove(next(iter(self.entries)))
+            self.stats['evictions'] += 1
+
+    def _remove(self, key):
+        serialized, _ = self.entries.pop(key)
+        self.num_bytes -= len(serialized)
@@ -3,6 +3,10 @@ import random
 from scipy.stats import geom
 from sklearn.cluster import affinity_propagation
 from .clustering_utils import *
+from . import metrics
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 def cluster_by_affinity_propagation(document, predictions, percentile_preference=99):
@@ -12,7 +16,7 @@ def cluster_by_affinity_propagation(document, predictions, percentile_preference
                 return True
         return False
 
-    affinity_matrix = generate_affinity_matrix(document, predictions)
+    affinity_matrix = dense_affinity_matrix(generate_sparse_affinity_matrix(document, predictions))
     # preference = [1 if mention_contains_proper_noun(mention) else 0.5 for mention in document.mentions]
     preference = [np.percentile(predictions, percentile_preference) for _ in range(len(document.mentions))]
 
@@ -69,23 +73,62 @@ def cluster_by_closest_antecedent(document, predictions, threshold=0.5):
     @arg threshold The classification threshold, above this value mentions are
      considered coreferent.
     """
-    affinity_matrix = generate_affinity_matrix(document, predictions)
-    
-    print("\n** Cluster by Closest Antecedent **\n")
-    print(predictions)
-    print(affinity_matrix)
+    with metrics.timed('affinity'):
+        affinity_matrix = generate_sparse_affinity_matrix(document, predictions, threshold)
+
+    with metrics.timed('clustering'):
+        links = closest_antecedent_links(affinity_matrix, threshold)
+        clusters = coreference_links_to_entity_clusters(links)
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('Cluster by closest antecedent. Predictions: %s. Affinity matrix: %s. Links: %s',
+                     predictions, affinity_matrix, links)
+    return clusters
 
+
+def cluster_by_closest_antecedent_lazy(document, score_pairs, threshold=0.5, block_size=8):
+    """
+    Clusters the document's mentions by matching each with its closest antecedent,
+     as cluster_by_closest_antecedent, but scoring mention-pairs lazily.
+    Antecedents are scored nearest first, in blocks of antecedent distances
+     (doubling in size), for all mentions still without a link. A mention's
+     farther antecedents aren't scored once it's linked.
+    @arg document The document containing the mentions.
+    @arg score_pairs Function scoring the mention-pairs given by two arrays of
+     mention indices, (m1_idx, m2_idx), with m1 preceding m2.
+    @arg threshold The classification threshold, above this value mentions are
+     considered coreferent.
+    @arg block_size Number of antecedent distances scored in the first block.
+    """
     num_mentions = len(document.mentions)
     links = np.ndarray(shape=(num_mentions,), dtype=int)
     links.fill(Link.NO_ANTECEDENT)
-    for current_idx in range(1, num_mentions):
-        for antecedent_idx in range(current_idx - 1, -1, -1):
-            if affinity_matrix[current_idx, antecedent_idx] > threshold:
-                links[current_idx] = antecedent_idx
-                break # break from the inner loop
 
-    print(links)
-    return coreference_links_to_entity_clusters(links)
+    pending = np.arange(1, num_mentions)
+    min_distance = 1
+    while len(pending) > 0:
+        distances = np.arange(min_distance, min_distance + block_size)
+        m2_idx = np.repeat(pending, block_size)
+        m1_idx = m2_idx - np.tile(distances, len(pending))
+        has_antecedent = m1_idx >= 0
+
+        scores = np.full(len(m2_idx), -np.inf, dtype=np.float32)
+        scores[has_antecedent] = np.asarray(
+            score_pairs(m1_idx[has_antecedent], m2_idx[has_antecedent]), dtype=np.float32
+        ).reshape(-1)
+
+        coreferent = (scores > threshold).reshape(len(pending), block_size)
+        is_linked = coreferent.any(axis=1)
+        closest = distances[coreferent.argmax(axis=1)]
+        links[pending[is_linked]] = pending[is_linked] - closest[is_linked]
+
+        is_exhausted = pending <= distances[-1]
+        pending = pending[~is_linked & ~is_exhausted]
+        min_distance += block_size
+        block_size *= 2
+
+    with metrics.timed('clustering'):
+        return coreference_links_to_entity_clusters(links)
 
 
 def cluster_by_best_antecedent(document, predictions, threshold=0.5):
@@ -96,15 +139,7 @@ def cluster_by_best_antecedent(document, predictions, threshold=0.5):
     @arg threshold The classification threshold, above this value mentions are
      considered coreferent.
     """
-    affinity_matrix = generate_affinity_matrix(document, predictions)
-
-    num_mentions = len(document.mentions)
-    links = np.ndarray(shape=(num_mentions,), dtype=int)
-    links.fill(Link.NO_ANTECEDENT)
-    for current_idx in range(1, num_mentions):
-        mention_scores = [score if score > threshold else 0 for score in affinity_matrix[current_idx]]
-        best_antecedent = np.argmax(mention_scores)
-        if best_antecedent < current_idx:
-            links[current_idx] = best_antecedent
+    affinity_matrix = generate_sparse_affinity_matrix(document, predictions, threshold)
 
+    links = best_antecedent_links(affinity_matrix, threshold)
     return coreference_links_to_entity_clusters(links)
@@ -4,7 +4,7 @@ clustering_utils.py: utilitary functions for the clustering.py module.
 
 import numpy as np
 from enum import IntEnum
-from .utils import find_in_sequence
+from scipy.sparse import csr_matrix, issparse, tril
 
 
 class Link(IntEnum):
@@ -34,31 +34,87 @@ def coreference_links_to_entity_clusters(links):
     """
     Transforms the given array of coreference links into a set of entities (mention clusters).
     Each entity/cluster is represented by the mentions' indices.
+    Clusters are ordered from the one with the last mention to the first.
     """
-    clusters = []
-    for i in range(len(links) - 1, -1, -1):
-        new_cluster = set()
-        j = i
+    num_mentions = len(links)
+    links = np.asarray(links)
 
-        while True:
-            antecedent = links[j]
-            links[j] = Link.PROCESSED
-            new_cluster.add(j)
+    # Array-backed union-find, each mention's parent is its antecedent
+    parents = np.where(links >= 0, links, np.arange(num_mentions))
+    # Path compression, pointing every mention straight to its cluster's root
+    while True:
+        grandparents = parents[parents]
+        if np.array_equal(grandparents, parents):
+            break
+        parents = grandparents
 
-            # end of coreference link
-            if antecedent == Link.NO_ANTECEDENT:
-                clusters.append(new_cluster)
-                break
-            # linking to previously processed cluster
-            elif antecedent == Link.PROCESSED:
-                previous_cluster_idx = find_in_sequence(lambda s: j in s, clusters)
-                clusters[previous_cluster_idx].update(new_cluster)
-                break
-
-            j = antecedent
+    clusters, root_clusters = [], dict()
+    for idx, root in zip(range(num_mentions - 1, -1, -1), parents[::-1].tolist()):
+        if root not in root_clusters:
+            root_clusters[root] = set()
+            clusters.append(root_clusters[root])
+        root_clusters[root].add(idx)
 
     return clusters
-    
+
+
+def closest_antecedent_links(affinity_matrix, threshold):
+    """
+    Links each mention to its closest antecedent with an affinity above the given
+     threshold, or to NO_ANTECEDENT if there's none.
+    @arg affinity_matrix Either a dense affinity matrix or a sparse one (see
+     generate_sparse_affinity_matrix).
+    """
+    num_mentions = affinity_matrix.shape[0]
+    if issparse(affinity_matrix):
+        scores = tril(affinity_matrix, k=-1).tocoo()
+        coreferent = scores.data > threshold
+        links = np.ndarray(shape=(num_mentions,), dtype=int)
+        links.fill(Link.NO_ANTECEDENT)
+        np.maximum.at(links, scores.row[coreferent], scores.col[coreferent])
+        return links
+
+    if num_mentions == 0:
+        return np.zeros(0, dtype=int)
+
+    coreferent = np.tril(affinity_matrix > threshold, k=-1)
+    has_antecedent = coreferent.any(axis=1)
+    closest = num_mentions - 1 - np.argmax(coreferent[:, ::-1], axis=1)
+    return np.where(has_antecedent, closest, Link.NO_ANTECEDENT)
+
+
+def best_antecedent_links(affinity_matrix, threshold):
+    """
+    Links each mention to the mention with its highest affinity (scores not above
+     the threshold count as 0), if that mention is an antecedent, or else to
+     NO_ANTECEDENT.
+    @arg affinity_matrix Either a dense affinity matrix or a sparse one (see
+     generate_sparse_affinity_matrix).
+    """
+    num_mentions = affinity_matrix.shape[0]
+    if issparse(affinity_matrix):
+        lower = tril(affinity_matrix, k=-1)
+        scores = (lower + lower.T).tocoo()
+        above = scores.data > threshold
+        rows, cols, data = scores.row[above], scores.col[above], scores.data[above]
+
+        # Highest score of each row, ties broken by the lowest column as np.argmax does
+        order = np.lexsort((cols, -data, rows))
+        rows, cols = rows[order], cols[order]
+        is_first = np.ones(len(rows), dtype=bool)
+        is_first[1:] = rows[1:] != rows[:-1]
+
+        best = np.zeros(num_mentions, dtype=int)    # argmax of a row of zeros
+        best[rows[is_first]] = cols[is_first]
+        return np.where(best < np.arange(num_mentions), best, Link.NO_ANTECEDENT)
+
+    if num_mentions == 0:
+        return np.zeros(0, dtype=int)
+
+    scores = np.where(affinity_matrix > threshold, affinity_matrix, 0)
+    best = np.argmax(scores, axis=1)
+    return np.where(best < np.arange(num_mentions), best, Link.NO_ANTECEDENT)
+
 
 def generate_affinity_matrix(document, mention_pair_predictions):
     """
@@ -66,12 +122,37 @@ def generate_affinity_matrix(document, mention_pair_predictions):
     @returns affinity_matrix[m1_idx, m2_idx] = affinity_score
     """
     num_mentions = len(document.mentions)
-    affinity_matrix = np.ndarray(shape=(num_mentions, num_mentions), dtype=np.float32)
-    affinity_matrix.fill(0)
+    affinity_matrix = np.zeros(shape=(num_mentions, num_mentions), dtype=np.float32)
 
-    for idx in range(len(mention_pair_predictions)):
-        i1, i2 = document.pairwise_combinations[idx]
-        affinity_matrix[i1,i2] = mention_pair_predictions[idx]
-        affinity_matrix[i2,i1] = mention_pair_predictions[idx]
+    mention_pairs = document.mention_pairs
+    scores = np.asarray(mention_pair_predictions, dtype=np.float32).reshape(-1)
+    affinity_matrix[mention_pairs.m1_idx, mention_pairs.m2_idx] = scores
+    affinity_matrix[mention_pairs.m2_idx, mention_pairs.m1_idx] = scores
 
     return affinity_matrix
+
+
+def generate_sparse_affinity_matrix(document, mention_pair_predictions, threshold=None):
+    """
+    Generates a sparse (CSR) lower-triangular affinity matrix from the given
+     mention-pair scores, holding each mention-pair once.
+    @arg threshold If given, only scores above this value are kept.
+    @returns affinity_matrix[m2_idx, m1_idx] = affinity_score, with m1 preceding m2
+    """
+    num_mentions = len(document.mentions)
+    mention_pairs = document.mention_pairs
+    scores = np.asarray(mention_pair_predictions, dtype=np.float32).reshape(-1)
+    rows, cols = mention_pairs.m2_idx, mention_pairs.m1_idx
+
+    if threshold is not None:
+        above = scores > threshold
+        scores, rows, cols = scores[above], rows[above], cols[above]
+
+    return csr_matrix((scores, (rows, cols)), shape=(num_mentions, num_mentions))
+
+
+def dense_affinity_matrix(sparse_affinity_matrix):
+    """
+    Dense, symmetric, view of the given sparse lower-triangular affinity matrix.
+    """
+    return (sparse_affinity_matrix + sparse_affinity_matrix.T).toarray()
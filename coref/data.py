@@ -6,57 +6,78 @@ from keras.preprocessing.sequence import pad_sequences
 from keras.utils import to_categorical
 from .semeval import MentionPair, Mention, Document
 from .semeval_utils import IdxUtils
-from .utils import bin_scalar
+from .utils import bin_scalars
+
+
+DISTANCE_BINS = [0, 1, 2, 3, 4, 5, 8, 16, 32, 64, math.inf] # Following Clark and Manning (2016)
 
 
 def process_mention_pairs_to_output(mention_pairs):
     """
-    Processes the given mention pairs into a tensor, Y, with the expected output.
+    Processes the given mention pairs into a tensor, Y, with the expected output:
+     whether both mentions refer to the same gold entity (Mention.entity_id,
+     see semeval_reader). Mentions without an entity corefer with none.
     """
-    Y = np.empty(shape=(len(mention_pairs),), dtype='int32')
-    for idx in range(len(mention_pairs)):
-        Y[idx] = 1 if mention_pairs[idx].is_coreferent else 0
+    entity_ids = [mention.entity_id for mention in mention_pairs.document.mentions]
+    has_entity = np.array([entity_id is not None for entity_id in entity_ids], dtype=bool)
+    # Entity ids as integer labels, so pairs are compared at once
+    label_of = dict()
+    labels = np.array([label_of.setdefault(entity_id, len(label_of)) for entity_id in entity_ids], dtype=np.int64)
 
-    return Y
+    m1_idx, m2_idx = mention_pairs.m1_idx, mention_pairs.m2_idx
+    Y = (labels[m1_idx] == labels[m2_idx]) & has_entity[m1_idx] & has_entity[m2_idx]
+    return Y.astype('int32')
 
 
 def process_mention_pairs_to_distance_features(mention_pairs, num_features=2):
     """
     Processes the given mention pairs into a vector of scalar features (e.g.
-     sentence distance, mention distance, one-hot encoded pos tags, ...).
+     sentence distance, token distance, mention distance).
+    Each distance column is binned at once, for all mention pairs.
     """
-    bins = [0, 1, 2, 3, 4, 5, 8, 16, 32, 64, math.inf] # Following Clark and Manning (2016)
-    bin_distance = lambda x: bin_scalar(x, bins)
-
-    num_mention_pairs = len(mention_pairs)
+    if num_features > 3:
+        raise RuntimeWarning('Invalid number of distance features: {}'.format(num_features))
 
-    X_scalar = np.empty(shape=(num_mention_pairs, num_features), dtype='float32')
-    for idx, mp in enumerate(mention_pairs):
-        features = [bin_distance(mp.sent_dist)]
-        if num_features >= 2:
-            features.append(bin_distance(mp.token_dist))
-        if num_features == 3:
-            # features.append(bin_distance(mp.mention_dist))
-            pass # TODO distance in mentions ?
-        elif num_features > 3:
-            raise RuntimeWarning('Invalid number of distance features: {}'.format(num_features))
+    distances = [mention_pairs.sent_dist, mention_pairs.token_dist, mention_pairs.mention_dist]
 
-        X_scalar[idx] = features
+    X_scalar = np.empty(shape=(len(mention_pairs), num_features), dtype='float32')
+    for idx in range(num_features):
+        X_scalar[:, idx] = bin_scalars(distances[idx], DISTANCE_BINS)
 
     return X_scalar
 
 
-def process_mention_pairs_to_indices(mention_pairs, tokenizer, max_mention_length=50):
+def process_mentions_to_indices(mentions, tokenizer, max_mention_length=50, sequence_cache=None):
     """
-    Processes the given mention pairs into an input dataset, parsing mention tokens
-     into their indices in the embedding layer according to the given tokenizer.
+    Processes the given mentions into a (num_mentions, max_mention_length) matrix,
+     parsing mention tokens into their indices in the embedding layer according
+     to the given tokenizer.
+    Each distinct mention string is tokenized and padded only once.
+    @arg sequence_cache Optional SequenceCache of the given tokenizer, shared
+     between calls.
     """
-    num_mention_pairs = len(mention_pairs)
-    X_m1 = np.empty(shape=(num_mention_pairs, max_mention_length), dtype='int32')
-    X_m2 = np.empty(shape=(num_mention_pairs, max_mention_length), dtype='int32')
+    unique_texts, mention_rows = list(), list()
+    text_rows = dict()
+    for mention in mentions:
+        if mention.full_mention not in text_rows:
+            text_rows[mention.full_mention] = len(unique_texts)
+            unique_texts.append(mention.full_mention)
+        mention_rows.append(text_rows[mention.full_mention])
+
+    if sequence_cache is None:
+        sequences = tokenizer.texts_to_sequences(unique_texts)
+    else:
+        sequences = sequence_cache.texts_to_sequences(unique_texts)
 
-    for idx, mp in enumerate(mention_pairs):
-        seq_m1, seq_m2 = tokenizer.texts_to_sequences([mp.m1.full_mention, mp.m2.full_mention])
-        X_m1[idx], X_m2[idx] = pad_sequences([seq_m1, seq_m2], maxlen=max_mention_length)
+    X_unique = pad_sequences(sequences, maxlen=max_mention_length).astype('int32', copy=False)
+    return X_unique[np.array(mention_rows, dtype=np.int64)]
 
-    return X_m1, X_m2
+
+def process_mention_pairs_to_indices(mention_pairs, tokenizer, max_mention_length=50, sequence_cache=None):
+    """
+    Processes the given mention pairs into an input dataset, parsing mention tokens
+     into their indices in the embedding layer according to the given tokenizer.
+    """
+    X_mentions = process_mentions_to_indices(
+        mention_pairs.document.mentions, tokenizer, max_mention_length, sequence_cache)
+    return X_mentions[mention_pairs.m1_idx], X_mentions[mention_pairs.m2_idx]
@@ -0,0 +1,136 @@
+"""
+evaluation.py: evaluates a model on a SemEval-2010 corpus (gold mentions),
+ comparing clustering strategies side by side.
+
+Documents are streamed from the corpus (see semeval_reader) to a pool of worker
+ processes, each loading its own model. Each document's mention-pairs are
+ scored once, and clustered with every strategy. Scores are micro-averaged
+ over the corpus (see scorer), and reported as JSON with the throughput.
+
+Usage: python -m coref.evaluation corpus.txt [--model pt] [--workers N]
+                                  [--strategies closest best affinity] [--memory-map]
+                                  [--max-documents N] [--output results.json]
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import itertools
+from collections import OrderedDict
+from .clustering import cluster_by_closest_antecedent, cluster_by_best_antecedent, \
+    cluster_by_affinity_propagation, cluster_all_mentions_separately
+from .semeval_reader import read_documents, gold_clusters
+from .scorer import score_document, add_counts, summarize
+from .utils import bounded_imap
+
+logger = logging.getLogger(__name__)
+
+STRATEGIES = OrderedDict([
+    ('closest', cluster_by_closest_antecedent),
+    ('best', cluster_by_best_antecedent),
+    ('affinity', cluster_by_affinity_propagation),
+])
+
+
+def evaluate_document(doc, model_key, strategies):
+    """
+    Scores the document's mention-pairs with the given model, and clusters
+     them with each of the given strategies.
+    @returns (number of mentions, prediction seconds, {strategy: (scorer counts, clustering seconds)})
+    """
+    from . import api
+
+    start = time.perf_counter()
+    predictions = None
+    if len(doc.mentions) > 1:
+        mps, X_mentions, X_scalar = api.featurize_document(doc, model_key)
+        predictions = api.cached_models.predict_pairs(model_key, X_mentions, mps.m1_idx, mps.m2_idx, X_scalar)
+    prediction_time = time.perf_counter() - start
+
+    key = gold_clusters(doc)
+    results = dict()
+    for strategy in strategies:
+        start = time.perf_counter()
+        if predictions is None:
+            clusters = cluster_all_mentions_separately(doc)
+        else:
+            clusters = STRATEGIES[strategy](doc, predictions)
+        results[strategy] = (score_document(key, clusters), time.perf_counter() - start)
+    return len(doc.mentions), prediction_time, results
+
+
+def evaluate(documents, model_key, strategies=tuple(STRATEGIES), workers=0):
+    """
+    Evaluates the given model and clustering strategies on the given documents
+     (e.g. read_documents), in a pool of the given number of worker processes
+     (0 evaluates in this process).
+    Models are loaded in each worker, which must fork before this process
+     loads them (TF sessions don't survive a fork).
+    @returns JSON serializable dict of each strategy's scores and throughput
+    """
+    start = time.perf_counter()
+    totals = {strategy: dict() for strategy in strategies}
+    clustering_time = {strategy: 0. for strategy in strategies}
+    num_documents, num_mentions, prediction_time = 0, 0, 0.
+
+    evaluated = bounded_imap(evaluate_document, documents, (model_key, strategies), workers)
+    for doc_mentions, doc_prediction_time, results in evaluated:
+        num_documents += 1
+        num_mentions += doc_mentions
+        prediction_time += doc_prediction_time
+        for strategy, (counts, elapsed) in results.items():
+            add_counts(totals[strategy], counts)
+            clustering_time[strategy] += elapsed
+        if num_documents % 100 == 0:
+            logger.info('Evaluated %d documents.', num_documents)
+
+    elapsed = time.perf_counter() - start
+    return {
+        'model': model_key,
+        'documents': num_documents,
+        'mentions': num_mentions,
+        'workers': workers,
+        'elapsed_s': elapsed,
+        'documents_per_second': num_documents / elapsed if elapsed else None,
+        'prediction_s': prediction_time,
+        'strategies': {
+            strategy: {
+                'scores': summarize(totals[strategy]),
+                'clustering_s': clustering_time[strategy],
+                'clustering_documents_per_second':
+                    num_documents / clustering_time[strategy] if clustering_time[strategy] else None,
+            }
+            for strategy in strategies
+        },
+    }
+
+
+def parse_args(argv):
+    from .api import MODEL_KEYS
+    parser = argparse.ArgumentParser(description='Evaluates a model and clustering strategies on a SemEval-2010 corpus.')
+    parser.add_argument('corpus', help='SemEval-2010 column file.')
+    parser.add_argument('--model', choices=MODEL_KEYS, default=MODEL_KEYS[0])
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes (0 for none).')
+    parser.add_argument('--strategies', nargs='+', choices=list(STRATEGIES), default=list(STRATEGIES))
+    parser.add_argument('--memory-map', action='store_true', help='Read the corpus through a memory map.')
+    parser.add_argument('--max-documents', type=int, default=None)
+    parser.add_argument('--encoding', default='utf-8')
+    parser.add_argument('--output', default=None, help='Also write the results to this JSON file.')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper())
+    args = parse_args(sys.argv[1:])
+    documents = itertools.islice(
+        read_documents(args.corpus, encoding=args.encoding, memory_map=args.memory_map), args.max_documents)
+    results = evaluate(documents, args.model, args.strategies, args.workers)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output)
+    print(output)
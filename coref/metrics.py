@@ -0,0 +1,150 @@
+"""
+metrics.py: in-process latency histograms and counters, exported in the
+ Prometheus text format.
+"""
+
+import math
+import time
+import threading
+from contextlib import contextmanager
+
+
+# Latency buckets, in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30., math.inf)
+# Size buckets, for number of mentions or mention-pairs per document
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 100000, 1000000, math.inf)
+
+
+class Histogram(object):
+    """
+    Cumulative histogram of observed values, as Prometheus' histograms.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value):
+        for idx, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                self.counts[idx] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+class Registry(object):
+    """
+    Holds named metrics, each with one series per set of label values.
+    Collectors are functions called on export, returning extra samples as a
+     list of (name, type, description, [(labels dict, value), ...]).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = dict()   # name -> (type, description, {labels tuple: Histogram or value})
+        self.collectors = list()
+
+    def observe(self, name, value, description='', buckets=DEFAULT_BUCKETS, **labels):
+        with self.lock:
+            series = self._series(name, 'histogram', description)
+            key = tuple(sorted(labels.items()))
+            if key not in series:
+                series[key] = Histogram(buckets)
+            series[key].observe(value)
+
+    def increment(self, name, value=1, description='', **labels):
+        with self.lock:
+            series = self._series(name, 'counter', description)
+            key = tuple(sorted(labels.items()))
+            series[key] = series.get(key, 0) + value
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        """
+        Exports all metrics in the Prometheus text format (version 0.0.4).
+        """
+        lines = list()
+        with self.lock:
+            for name in sorted(self.metrics):
+                metric_type, description, series = self.metrics[name]
+                lines.extend(_header(name, metric_type, description))
+                for key in sorted(series):
+                    if metric_type == 'histogram':
+                        lines.extend(_histogram_lines(name, dict(key), series[key]))
+                    else:
+                        lines.append(_sample(name, dict(key), series[key]))
+
+        for collector in self.collectors:
+            for name, metric_type, description, samples in collector():
+                lines.extend(_header(name, metric_type, description))
+                lines.extend(_sample(name, labels, value) for labels, value in samples)
+
+        return '\n'.join(lines) + '\n'
+
+    def _series(self, name, metric_type, description):
+        if name not in self.metrics:
+            self.metrics[name] = (metric_type, description, dict())
+        return self.metrics[name][2]
+
+
+def _header(name, metric_type, description):
+    return ['# HELP {} {}'.format(name, description), '# TYPE {} {}'.format(name, metric_type)]
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _sample(name, labels, value):
+    if not labels:
+        return '{} {}'.format(name, _format_value(value))
+    label_str = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                         for k, v in sorted(labels.items()))
+    return '{}{{{}}} {}'.format(name, label_str, _format_value(value))
+
+
+def _histogram_lines(name, labels, histogram):
+    lines, cumulative = list(), 0
+    for upper_bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        bucket_labels = dict(labels, le=_format_value(upper_bound))
+        lines.append(_sample(name + '_bucket', bucket_labels, cumulative))
+    lines.append(_sample(name + '_sum', labels, histogram.sum))
+    lines.append(_sample(name + '_count', labels, histogram.count))
+    return lines
+
+
+registry = Registry()
+
+
+@contextmanager
+def timed(stage):
+    """
+    Records the latency of the enclosed block, as the given pipeline stage.
+    """
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        registry.observe('coref_stage_duration_seconds', time.monotonic() - start,
+                         description='Latency of each coreference pipeline stage.', stage=stage)
+
+
+def record_document(num_mentions, num_mention_pairs):
+    """
+    Records the size of a processed document.
+    """
+    registry.increment('coref_documents_total', description='Number of documents processed.')
+    registry.increment('coref_mentions_total', num_mentions, description='Number of mentions processed.')
+    registry.increment('coref_mention_pairs_total', num_mention_pairs, description='Number of mention-pairs scored.')
+    registry.observe('coref_document_mentions', num_mentions, buckets=SIZE_BUCKETS,
+                     description='Number of mentions per document.')
+    registry.observe('coref_document_mention_pairs', num_mention_pairs, buckets=SIZE_BUCKETS,
+                     description='Number of mention-pairs per document.')
@@ -0,0 +1,214 @@
+"""
+models.py: splitting of mention-pair models into a per-mention encoder and a
+ pair-scoring head.
+
+The mention-pair models take [X_m1, X_m2, X_scalar] as input, and encode each
+ mention's token indices independently before combining both encodings with
+ the distance features. Splitting the graph at that point allows each mention
+ to be encoded once per document, instead of once per mention-pair.
+"""
+
+import numpy as np
+from keras import backend as K
+from keras.layers import Input
+from keras.models import Model
+
+
+M1_INPUT, M2_INPUT, SCALAR_INPUT = 0, 1, 2
+
+
+def _inbound_node(tensor):
+    layer, node_index, tensor_index = tensor._keras_history
+    inbound_nodes = getattr(layer, '_inbound_nodes', None) or layer.inbound_nodes
+    return layer, inbound_nodes[node_index], tensor_index
+
+
+def _is_input(tensor):
+    layer, node, _ = _inbound_node(tensor)
+    return not node.inbound_layers
+
+
+def _graph_nodes(outputs):
+    """
+    Returns the (layer, node) pairs that the given output tensors depend on,
+     in topological order (inputs first).
+    """
+    visited, ordered = set(), list()
+
+    def visit(tensor):
+        layer, node, _ = _inbound_node(tensor)
+        if id(node) in visited:
+            return
+        visited.add(id(node))
+        for t in node.input_tensors:
+            if t is not tensor:
+                visit(t)
+        ordered.append((layer, node))
+
+    for output in outputs:
+        visit(output)
+    return ordered
+
+
+def _input_dependencies(model):
+    """
+    Maps each tensor (by id) in the model's graph to the set of the model's
+     input indices it depends on.
+    """
+    dependencies = {id(t): frozenset([idx]) for idx, t in enumerate(model.inputs)}
+    for layer, node in _graph_nodes(model.outputs):
+        if not node.inbound_layers:
+            continue
+        deps = frozenset().union(*[dependencies[id(t)] for t in node.input_tensors])
+        for t in node.output_tensors:
+            dependencies[id(t)] = deps
+    return dependencies
+
+
+def _find_encoding(model, input_idx, dependencies):
+    """
+    Finds the last tensor computed solely from the given mention input, before
+     it is combined with the other inputs.
+    """
+    branch = frozenset([input_idx])
+    encodings, branch_layers = list(), set()
+    for layer, node in _graph_nodes(model.outputs):
+        if not node.inbound_layers:
+            continue
+        if dependencies[id(node.output_tensors[0])] == branch:
+            branch_layers.add(layer)
+            continue
+        for t in node.input_tensors:
+            if dependencies[id(t)] == branch and all(t is not e for e in encodings):
+                encodings.append(t)
+
+    if len(encodings) != 1:
+        raise ValueError('Mention input {} reaches the rest of the model through {} tensors, '
+                         'expected exactly one.'.format(input_idx, len(encodings)))
+    return encodings[0], branch_layers
+
+
+def _replay(outputs, substitutions):
+    """
+    Rebuilds the graph leading to the given outputs, starting from the given
+     substitute tensors (a dict of id(original_tensor) -> new_tensor).
+    Layers are re-applied to the new tensors, thus sharing their weights.
+    """
+    replayed = dict(substitutions)
+
+    def replay(tensor):
+        if id(tensor) in replayed:
+            return replayed[id(tensor)]
+        if _is_input(tensor):
+            raise ValueError('Tensor {} is not reachable from the given substitutions.'.format(tensor))
+
+        layer, node, tensor_index = _inbound_node(tensor)
+        inputs = [replay(t) for t in node.input_tensors]
+        arguments = getattr(node, 'arguments', None) or {}
+        new_outputs = layer(inputs if len(inputs) > 1 else inputs[0], **arguments)
+        if not isinstance(new_outputs, list):
+            new_outputs = [new_outputs]
+        for original, new in zip(node.output_tensors, new_outputs):
+            replayed[id(original)] = new
+        return replayed[id(tensor)]
+
+    return [replay(output) for output in outputs]
+
+
+def _input_like(tensor, name):
+    return Input(shape=K.int_shape(tensor)[1:], dtype=K.dtype(tensor), name=name)
+
+
+class SplitMentionPairModel(object):
+    """
+    A mention-pair model split into mention encoder(s) and a pair-scoring head.
+    When both mention branches share their layers a single encoder is used.
+    """
+
+    def __init__(self, model):
+        dependencies = _input_dependencies(model)
+        m1_encoding, m1_layers = _find_encoding(model, M1_INPUT, dependencies)
+        m2_encoding, m2_layers = _find_encoding(model, M2_INPUT, dependencies)
+
+        self.shared_encoder = m1_layers == m2_layers
+        # Shape and type of each mention's encodings, for documents without mentions
+        self.encoding_specs = [(K.int_shape(encoding)[1:], K.dtype(encoding))
+                               for encoding in (m1_encoding, m2_encoding)]
+        self.encoders = [Model(model.inputs[M1_INPUT], m1_encoding)]
+        if not self.shared_encoder:
+            self.encoders.append(Model(model.inputs[M2_INPUT], m2_encoding))
+
+        head_inputs = [
+            _input_like(m1_encoding, 'm1_encoding'),
+            _input_like(m2_encoding, 'm2_encoding'),
+            _input_like(model.inputs[SCALAR_INPUT], 'scalar_features'),
+        ]
+        head_outputs = _replay(model.outputs, {
+            id(m1_encoding): head_inputs[0],
+            id(m2_encoding): head_inputs[1],
+            id(model.inputs[SCALAR_INPUT]): head_inputs[2],
+        })
+        self.head = Model(head_inputs, head_outputs)
+
+        for sub_model in self.encoders + [self.head]:
+            sub_model._make_predict_function()
+
+    def encode(self, X_mentions):
+        """
+        Encodes each mention once.
+        @returns [m1_encodings, m2_encodings], one row per mention
+        """
+        if len(X_mentions) == 0:
+            return self.empty_encodings()
+        encodings = [encoder.predict(X_mentions) for encoder in self.encoders]
+        return encodings * 2 if self.shared_encoder else encodings
+
+    def empty_encodings(self):
+        """
+        Encodings of no mentions, as Keras' predict returns an empty list rather
+         than empty arrays for empty batches.
+        """
+        encodings = [np.zeros(shape=(0,) + shape, dtype=dtype) for shape, dtype in self.encoding_specs]
+        return [encodings[0]] * 2 if self.shared_encoder else encodings
+
+    def predict(self, X_mentions, m1_idx, m2_idx, X_scalar):
+        m1_encodings, m2_encodings = self.encode(X_mentions)
+        return self.head.predict([m1_encodings[m1_idx], m2_encodings[m2_idx], X_scalar])
+
+
+def sample_inputs(model, num_mentions=4, seed=0):
+    """
+    Random inputs matching the model's input shapes: the token indices of
+     num_mentions mentions, and the distance features of all their pairs.
+    @returns (X_mentions, m1_idx, m2_idx, X_scalar)
+    """
+    max_mention_length = K.int_shape(model.inputs[M1_INPUT])[1] or 50
+    num_scalar_features = K.int_shape(model.inputs[SCALAR_INPUT])[1] or 2
+
+    rng = np.random.RandomState(seed)
+    X_mentions = rng.randint(0, 2, size=(num_mentions, max_mention_length)).astype('int32')
+    m1_idx, m2_idx = np.triu_indices(num_mentions, k=1)
+    X_scalar = rng.randint(0, 10, size=(len(m1_idx), num_scalar_features)).astype('float32')
+    return X_mentions, m1_idx, m2_idx, X_scalar
+
+
+def verify_split_model(model, split_model, atol=1e-5):
+    """
+    Checks that the split model scores a sample of mention-pairs as the original
+     model does, within the given tolerance.
+    """
+    X_mentions, m1_idx, m2_idx, X_scalar = sample_inputs(model)
+    expected = model.predict([X_mentions[m1_idx], X_mentions[m2_idx], X_scalar])
+    actual = split_model.predict(X_mentions, m1_idx, m2_idx, X_scalar)
+    return np.allclose(expected, actual, atol=atol)
+
+
+def warm_up(model, split_model=None):
+    """
+    Runs a small prediction, so that the first request doesn't pay for the
+     session's and graph's lazy initialization.
+    """
+    X_mentions, m1_idx, m2_idx, X_scalar = sample_inputs(model)
+    model.predict([X_mentions[m1_idx], X_mentions[m2_idx], X_scalar])
+    if split_model is not None:
+        split_model.predict(X_mentions, m1_idx, m2_idx, X_scalar)
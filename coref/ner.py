@@ -0,0 +1,150 @@
+"""
+ner.py: parallel, cached named entity recognition with polyglot, for automatic
+ mention detection.
+
+Polyglot tags each word from the embeddings of the words around it, up to
+ CONTEXT words away on each side, over the whole text. The text's words are
+ thus tagged in sentence units, each along with its CONTEXT neighbouring words
+ on each side, yielding the same tags as a single pass over the whole text.
+Tags are cached per unit (keyed by its words and context), units missing from
+ the cache are tagged in a process pool, and entities are chunked from the
+ whole text's tags as polyglot's Text.entities does.
+"""
+
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from .utils import LRUCache
+
+
+# Number of words on each side that polyglot's NEChunker looks at (TaggerBase.context)
+CONTEXT = 2
+OUTSIDE = 'O'
+
+
+def tag_units(language, units):
+    """
+    Tags the words of each unit, given as (left context, words, right context).
+    Runs in the pool's worker processes, which inherit the polyglot models
+     already loaded by the parent (polyglot caches them on first use).
+    """
+    from polyglot.tag import get_ner_tagger
+    ne_chunker = get_ner_tagger(lang=language)
+
+    tags = list()
+    for left, words, right in units:
+        annotations = ne_chunker.annotate(list(left) + list(words) + list(right))
+        unit_tags = [tag for _, tag in annotations]
+        tags.append(unit_tags[len(left): len(left) + len(words)])
+    return tags
+
+
+def chunk_entities(tags):
+    """
+    Groups the tagged words into entities, as polyglot's Text.entities.
+    This includes its quirk of adjacent entities of different tags: the second
+     one keeps the first one's start.
+    @returns list of (start, end, tag), over word indices
+    """
+    entities = list()
+    start, prev_tag, tag = 0, OUTSIDE, OUTSIDE
+    for idx, tag in enumerate(tags):
+        if tag != prev_tag:
+            if prev_tag == OUTSIDE:
+                start = idx
+            else:
+                entities.append((start, idx, prev_tag))
+            prev_tag = tag
+    if tag != OUTSIDE:
+        entities.append((start, len(tags), tag))
+    return entities
+
+
+class EntityRecognizer(object):
+    """
+    Recognizes the named entities of polyglot Texts, with per-sentence caching,
+     in a process pool of num_workers processes (0 tags in the calling thread).
+    Texts with fewer than min_parallel_words words to tag are tagged in the
+     calling thread, as the pool's overhead would outweigh its gain.
+    """
+
+    def __init__(self, num_workers=0, cache_size=10000, min_parallel_words=2000):
+        self.num_workers = num_workers
+        self.min_parallel_words = min_parallel_words
+        self.cache = LRUCache(cache_size)
+        self.lock = threading.Lock()
+        self.pool = None
+        self.stats = {'hits': 0, 'misses': 0, 'parallel_texts': 0}
+
+    def entities(self, text):
+        """
+        Entities of the given polyglot Text, identical to text.entities.
+        @returns list of (start, end, tag), over the text's word indices
+        """
+        language = text.language.code
+        words = [str(word) for word in text.words]
+
+        # Sentence units, if they cover the text's words (else a single unit)
+        lengths = [len(sentence.tokens) for sentence in text.sentences]
+        if sum(lengths) != len(words):
+            lengths = [len(words)]
+
+        keys, start = list(), 0
+        for length in lengths:
+            end = start + length
+            keys.append((language, tuple(words[max(start - CONTEXT, 0): start]),
+                         tuple(words[start: end]), tuple(words[end: end + CONTEXT])))
+            start = end
+
+        with self.lock:
+            unit_tags = [self.cache.get(key) for key in keys]
+            missing = list({key: None for key, tags in zip(keys, unit_tags) if tags is None})
+            self.stats['hits'] += len(keys) - len(missing)
+            self.stats['misses'] += len(missing)
+
+        if missing:
+            computed = dict(zip(missing, self._tag(language, [key[1:] for key in missing])))
+            with self.lock:
+                for key, tags in computed.items():
+                    self.cache.put(key, tags)
+            unit_tags = [computed[key] if tags is None else tags for key, tags in zip(keys, unit_tags)]
+
+        return chunk_entities([tag for tags in unit_tags for tag in tags])
+
+    def _tag(self, language, units):
+        num_words = sum(len(words) for _, words, _ in units)
+        if self.num_workers <= 0 or len(units) < 2 or num_words < self.min_parallel_words:
+            return tag_units(language, units)
+
+        with self.lock:
+            self.stats['parallel_texts'] += 1
+        # Contiguous batches of units, of about the same number of words each
+        num_batches = min(len(units), 4 * self.num_workers)
+        batches, batch, batch_words = list(), list(), 0
+        for unit in units:
+            batch.append(unit)
+            batch_words += len(unit[1])
+            if batch_words >= num_words / num_batches:
+                batches.append(batch)
+                batch, batch_words = list(), 0
+        if batch:
+            batches.append(batch)
+
+        futures = [self._get_pool().submit(tag_units, language, batch) for batch in batches]
+        return [tags for future in futures for tags in future.result()]
+
+    def _get_pool(self):
+        """
+        The process pool, started on first use so that its processes fork from
+         a process which already loaded the polyglot models (and not from a
+         prefork server's parent, see serving.py).
+        """
+        with self.lock:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(max_workers=self.num_workers)
+            return self.pool
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['cached_sentences'] = len(self.cache)
+        return stats
@@ -0,0 +1,109 @@
+"""
+scheduler.py: dynamic micro-batching of model predictions.
+
+Concurrent requests each score a small batch of mention-pairs. The scheduler
+ queues them, and a single worker thread per model concatenates the pending
+ inputs into one larger prediction, handing each request its slice.
+"""
+
+import queue
+import threading
+import time
+import numpy as np
+from concurrent.futures import Future
+
+
+class MicroBatchScheduler(object):
+    """
+    Runs the given predict function over batches of queued inputs, collected
+     for up to max_latency seconds or until max_batch_size rows are pending.
+    Inputs are lists of arrays, with one row per sample, as Keras' predict.
+    """
+
+    def __init__(self, predict, max_batch_size=8192, max_latency=0.005):
+        self.predict_fn = predict
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+
+        self.queue = queue.Queue()
+        self.stats_lock = threading.Lock()
+        self.stats = {
+            'requests': 0,
+            'batches': 0,
+            'rows': 0,
+            'max_batch_rows': 0,
+            'max_batch_requests': 0,
+            'max_queue_depth': 0,
+        }
+
+        self.thread = threading.Thread(target=self._run, name='micro-batch-scheduler')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, X):
+        """
+        Queues the given input for prediction.
+        @returns a Future of the input's predictions
+        """
+        future = Future()
+        self.queue.put((X, future))
+        with self.stats_lock:
+            self.stats['max_queue_depth'] = max(self.stats['max_queue_depth'], self.queue.qsize())
+        return future
+
+    def predict(self, X):
+        return self.submit(X).result()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def get_stats(self):
+        with self.stats_lock:
+            stats = dict(self.stats)
+        stats['queue_depth'] = self.queue.qsize()
+        stats['mean_batch_rows'] = stats['rows'] / stats['batches'] if stats['batches'] else 0.
+        stats['mean_batch_requests'] = stats['requests'] / stats['batches'] if stats['batches'] else 0.
+        return stats
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+
+            batch, num_rows = [item], len(item[0][0])
+            deadline = time.monotonic() + self.max_latency
+            while num_rows < self.max_batch_size:
+                try:
+                    item = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.queue.put(None)    # stop after this batch
+                    break
+                batch.append(item)
+                num_rows += len(item[0][0])
+
+            self._run_batch(batch, num_rows)
+
+    def _run_batch(self, batch, num_rows):
+        with self.stats_lock:
+            self.stats['requests'] += len(batch)
+            self.stats['batches'] += 1
+            self.stats['rows'] += num_rows
+            self.stats['max_batch_rows'] = max(self.stats['max_batch_rows'], num_rows)
+            self.stats['max_batch_requests'] = max(self.stats['max_batch_requests'], len(batch))
+
+        num_inputs = len(batch[0][0])
+        X = [np.concatenate([x[idx] for x, _ in batch]) for idx in range(num_inputs)]
+        try:
+            predictions = self.predict_fn(X)
+        except Exception as err:
+            for _, future in batch:
+                future.set_exception(err)
+            return
+
+        offsets = np.cumsum([len(x[0]) for x, _ in batch])[:-1]
+        for (_, future), request_predictions in zip(batch, np.split(predictions, offsets)):
+            future.set_result(request_predictions)
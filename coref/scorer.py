@@ -0,0 +1,199 @@
+"""
+scorer.py: coreference evaluation metrics (MUC, B-cubed, CEAF-e and BLANC).
+
+Key (gold) and response (predicted) entities are given as lists of clusters of
+ mentions, e.g. sets of mention indices as returned by clustering.py.
+Mentions may be any hashable, and key and response mentions may differ
+ (twinless mentions). All metrics are computed from the key-response overlap
+ matrix, whose entry (i, j) is the number of mentions of key cluster i in
+ response cluster j.
+
+Each metric's scorer returns counts, which are summed over a corpus's
+ documents (micro-average) and summarized into recall, precision and F1.
+"""
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix
+
+METRICS = ('muc', 'bcub', 'ceafe', 'blanc')
+
+
+class Overlap(object):
+    """
+    The overlap matrix of key and response clusters, and their sizes.
+    Empty clusters are ignored.
+    """
+
+    def __init__(self, key, response):
+        key = [cluster for cluster in key if len(cluster) > 0]
+        response = [cluster for cluster in response if len(cluster) > 0]
+
+        mention_ids = dict()
+        key_mentions = np.array([mention_ids.setdefault(m, len(mention_ids)) for c in key for m in c], dtype=np.int64)
+        response_mentions = np.array([mention_ids.setdefault(m, len(mention_ids)) for c in response for m in c],
+                                     dtype=np.int64)
+        self.key_sizes = np.array([len(c) for c in key], dtype=np.int64)
+        self.response_sizes = np.array([len(c) for c in response], dtype=np.int64)
+
+        # Each mention's key and response cluster, or -1
+        key_cluster = np.full(len(mention_ids), -1, dtype=np.int64)
+        key_cluster[key_mentions] = np.repeat(np.arange(len(key)), self.key_sizes)
+        response_cluster = np.full(len(mention_ids), -1, dtype=np.int64)
+        response_cluster[response_mentions] = np.repeat(np.arange(len(response)), self.response_sizes)
+
+        common = (key_cluster >= 0) & (response_cluster >= 0)
+        self.matrix = coo_matrix(
+            (np.ones(np.count_nonzero(common), dtype=np.int64), (key_cluster[common], response_cluster[common])),
+            shape=(len(key), len(response))
+        ).tocsr()   # duplicate entries are summed
+        self.matrix.eliminate_zeros()
+
+    def counts(self):
+        """
+        Nonzero overlaps, with their key and response clusters.
+        @returns (key cluster indices, response cluster indices, overlaps)
+        """
+        matrix = self.matrix.tocoo()
+        return matrix.row, matrix.col, matrix.data
+
+
+def muc(overlap):
+    """
+    MUC (Vilain et al., 1995): links needed to join each key (response)
+     cluster's partition by the response (key) clusters.
+    @returns (recall numerator, recall denominator, precision numerator, precision denominator)
+    """
+    matrix = overlap.matrix
+    # Partitions of each cluster: the clusters it overlaps, plus its twinless mentions as singletons
+    key_partitions = np.diff(matrix.indptr) + overlap.key_sizes - np.asarray(matrix.sum(axis=1)).reshape(-1)
+    columns = matrix.tocsc()
+    response_partitions = np.diff(columns.indptr) + overlap.response_sizes - np.asarray(columns.sum(axis=0)).reshape(-1)
+    return (
+        int(np.sum(overlap.key_sizes - key_partitions)), int(np.sum(overlap.key_sizes - 1)),
+        int(np.sum(overlap.response_sizes - response_partitions)), int(np.sum(overlap.response_sizes - 1)),
+    )
+
+
+def b_cubed(overlap):
+    """
+    B-cubed (Bagga and Baldwin, 1998): per mention, the fraction of its key
+     (response) cluster in its response (key) cluster.
+    @returns (recall numerator, recall denominator, precision numerator, precision denominator)
+    """
+    rows, cols, counts = overlap.counts()
+    squared = counts.astype(np.float64) ** 2
+    return (
+        float(np.sum(squared / overlap.key_sizes[rows])), int(np.sum(overlap.key_sizes)),
+        float(np.sum(squared / overlap.response_sizes[cols])), int(np.sum(overlap.response_sizes)),
+    )
+
+
+def ceaf_e(overlap):
+    """
+    Entity-based CEAF (Luo, 2005): similarity of the best one-to-one alignment
+     of key and response clusters, with phi4(K, R) = 2|K & R| / (|K| + |R|).
+    Only overlapping clusters are aligned, others have no similarity.
+    @returns (recall numerator, recall denominator, precision numerator, precision denominator)
+    """
+    rows, cols, counts = overlap.counts()
+    similarity = 0.
+    if len(counts) > 0:
+        key_clusters, row_idx = np.unique(rows, return_inverse=True)
+        response_clusters, col_idx = np.unique(cols, return_inverse=True)
+        phi = np.zeros(shape=(len(key_clusters), len(response_clusters)))
+        phi[row_idx, col_idx] = 2. * counts / (overlap.key_sizes[rows] + overlap.response_sizes[cols])
+        aligned_rows, aligned_cols = linear_sum_assignment(-phi)
+        similarity = float(phi[aligned_rows, aligned_cols].sum())
+    return similarity, len(overlap.key_sizes), similarity, len(overlap.response_sizes)
+
+
+def blanc(overlap):
+    """
+    BLANC (Recasens and Hovy, 2011), extended to twinless mentions (Luo et
+     al., 2014): coreference and non-coreference links of the key and
+     response, and those in both.
+    @returns (correct coreference links, key coreference links, response coreference links,
+     correct non-coreference links, key non-coreference links, response non-coreference links)
+    """
+    def pairs(sizes):
+        return int(np.sum(sizes * (sizes - 1) // 2))
+
+    rows, cols, counts = overlap.counts()
+    key_coref, response_coref = pairs(overlap.key_sizes), pairs(overlap.response_sizes)
+    correct_coref = pairs(counts)
+
+    # Non-coreference links among the mentions common to key and response
+    common_key_sizes = np.bincount(rows, weights=counts, minlength=len(overlap.key_sizes)).astype(np.int64)
+    common_response_sizes = np.bincount(cols, weights=counts, minlength=len(overlap.response_sizes)).astype(np.int64)
+    correct_non_coref = pairs(np.array([np.sum(counts)])) - pairs(common_key_sizes) \
+        - pairs(common_response_sizes) + correct_coref
+
+    key_non_coref = pairs(np.array([np.sum(overlap.key_sizes)])) - key_coref
+    response_non_coref = pairs(np.array([np.sum(overlap.response_sizes)])) - response_coref
+    return correct_coref, key_coref, response_coref, correct_non_coref, key_non_coref, response_non_coref
+
+
+SCORERS = {'muc': muc, 'bcub': b_cubed, 'ceafe': ceaf_e, 'blanc': blanc}
+
+
+def score_document(key, response, metrics=METRICS):
+    """
+    Counts of each of the given metrics for a document's key and response
+     clusters, to be summed over documents and summarized (see summarize).
+    @returns dict of metric -> numpy array of counts
+    """
+    overlap = Overlap(key, response)
+    return {metric: np.array(SCORERS[metric](overlap), dtype=np.float64) for metric in metrics}
+
+
+def add_counts(total, counts):
+    """
+    Adds a document's counts (see score_document) to the given totals.
+    """
+    for metric, metric_counts in counts.items():
+        total[metric] = total[metric] + metric_counts if metric in total else metric_counts.copy()
+    return total
+
+
+def _f1(recall, precision):
+    return 2 * recall * precision / (recall + precision) if recall + precision > 0 else 0.
+
+
+def _ratio(numerator, denominator):
+    return numerator / denominator if denominator > 0 else 0.
+
+
+def _scores(recall, precision):
+    return {'recall': float(recall), 'precision': float(precision), 'f1': float(_f1(recall, precision))}
+
+
+def summarize(counts):
+    """
+    Recall, precision and F1 of each metric from the given (summed) counts,
+     and the CoNLL score (mean F1 of MUC, B-cubed and CEAF-e) if available.
+    """
+    summary = dict()
+    for metric, metric_counts in counts.items():
+        if metric == 'blanc':
+            summary[metric] = _summarize_blanc(*metric_counts)
+        else:
+            r_num, r_den, p_num, p_den = metric_counts
+            summary[metric] = _scores(_ratio(r_num, r_den), _ratio(p_num, p_den))
+
+    if all(metric in summary for metric in ('muc', 'bcub', 'ceafe')):
+        summary['conll'] = float(np.mean([summary[metric]['f1'] for metric in ('muc', 'bcub', 'ceafe')]))
+    return summary
+
+
+def _summarize_blanc(correct_coref, key_coref, response_coref, correct_non_coref, key_non_coref, response_non_coref):
+    coref = _scores(_ratio(correct_coref, key_coref), _ratio(correct_coref, response_coref))
+    non_coref = _scores(_ratio(correct_non_coref, key_non_coref), _ratio(correct_non_coref, response_non_coref))
+
+    # Without coreference (or non-coreference) links in both key and response,
+    # BLANC is the score of the other links (Luo et al., 2014)
+    if key_coref == 0 and response_coref == 0:
+        return non_coref
+    if key_non_coref == 0 and response_non_coref == 0:
+        return coref
+    return {name: (coref[name] + non_coref[name]) / 2 for name in ('recall', 'precision', 'f1')}
@@ -1,6 +1,5 @@
 import io
 import numpy as np
-from sklearn.utils.extmath import cartesian
 from random import random
 from .semeval_utils import MentionUtils, IdxUtils, PoSTags
 
@@ -16,6 +15,8 @@ class Document:
         self.tokens = list() if tokens is None else tokens
         self.mentions = list()  # list of mentions, in order of appearance
         self.sentences = dict()
+        self.sentence_offsets = dict()  # index of each sentence's first token in the document
+        self.text = None    # text which the mentions' character spans index, if parsed from one
 
         self.id = Document.document_count
         Document.document_count += 1
@@ -31,46 +32,102 @@ class Document:
 
         if token.sentence_idx not in self.sentences:
             self.sentences[token.sentence_idx] = list()
+            self.sentence_offsets[token.sentence_idx] = len(self.tokens) - 1
         self.sentences[token.sentence_idx].append(token)
 
-    def generate_mention_pairs(self):
-        return self.generate_mps_all_antecedents()
+    def token_position(self, token):
+        """
+        Position of the given token in the document, in tokens.
+        Assumes tokens are added in order, sentence by sentence.
+        """
+        return self.sentence_offsets[token.sentence_idx] + token.get_id()
 
-    def generate_mps_all_antecedents(self):
-        self.mention_pairs = []
+    def generate_mention_pairs(self, max_mention_distance=None, max_sentence_distance=None, keep_string_matches=True):
+        """
+        Generates the document's mention-pairs, either pairing each mention with
+         all its antecedents, or only with those within the given window.
+        Pairs left out are considered non-coreferent.
+        @arg max_mention_distance Maximum distance, in mentions, to an antecedent.
+        @arg max_sentence_distance Maximum distance, in sentences, to an antecedent.
+        @arg keep_string_matches Whether to keep antecedents outside the window
+         whose string or head (last token) matches the mention's.
+        """
+        if max_mention_distance is None and max_sentence_distance is None:
+            return self.generate_mps_all_antecedents()
+        return self.generate_mps_windowed(max_mention_distance, max_sentence_distance, keep_string_matches)
 
+    def generate_mps_all_antecedents(self):
         num_mentions = len(self.mentions)
-        self.pairwise_combinations = [
-           [i1, i2] for i1, i2 in cartesian(((range(num_mentions), range(num_mentions)))) if i1 < i2
-        ]
-        # NOTE # i1 < i2 condition ensures different mentions and breaks symmetric pairs
-
-        for i1, i2 in self.pairwise_combinations:
-            assert i1 != i2, "mention-pair must have different mentions"
+        m1_idx, m2_idx = np.triu_indices(num_mentions, k=1)
+        # NOTE # upper triangle ensures different mentions and breaks symmetric pairs
 
-            m1, m2 = self.mentions[i1], self.mentions[i2]
-            self.mention_pairs.append(MentionPair(m1, m2))
+        self.mention_pairs = MentionPairs(self, m1_idx, m2_idx)
+        return self.mention_pairs
 
+    def generate_mps_windowed(self, max_mention_distance=None, max_sentence_distance=None, keep_string_matches=True):
+        num_mentions = len(self.mentions)
+        mention_idx = np.arange(num_mentions, dtype=np.int64)
+
+        first_antecedent = np.zeros(num_mentions, dtype=np.int64)
+        if max_mention_distance is not None:
+            first_antecedent = np.maximum(first_antecedent, mention_idx - max_mention_distance)
+        if max_sentence_distance is not None:
+            # Mentions are in order of appearance, thus sorted by sentence
+            sentence_idx = np.array([m.sentence_idx for m in self.mentions], dtype=np.int64)
+            first_in_window = np.searchsorted(sentence_idx, sentence_idx - max_sentence_distance, side='left')
+            first_antecedent = np.maximum(first_antecedent, first_in_window)
+
+        num_antecedents = np.maximum(mention_idx - first_antecedent, 0)
+        m2_idx = np.repeat(mention_idx, num_antecedents)
+        pair_offsets = np.cumsum(num_antecedents) - num_antecedents
+        m1_idx = np.arange(len(m2_idx), dtype=np.int64) + np.repeat(first_antecedent - pair_offsets, num_antecedents)
+
+        pair_keys = m1_idx * num_mentions + m2_idx
+        if keep_string_matches:
+            pair_keys = np.concatenate([pair_keys, self._string_match_pair_keys()])
+        pair_keys = np.unique(pair_keys)    # sorted as in generate_mps_all_antecedents
+
+        self.mention_pairs = MentionPairs(self, pair_keys // num_mentions, pair_keys % num_mentions)
         return self.mention_pairs
 
+    def _string_match_pair_keys(self):
+        """
+        Keys (m1_idx * num_mentions + m2_idx) of the mention-pairs whose full
+         strings or heads (last tokens) match, case-insensitively.
+        """
+        groups = dict()
+        for idx, mention in enumerate(self.mentions):
+            full_key = ('full', mention.full_mention.lower())
+            head_key = ('head', mention.tokens[-1].get_string().lower())
+            groups.setdefault(full_key, list()).append(idx)
+            groups.setdefault(head_key, list()).append(idx)
+
+        num_mentions = len(self.mentions)
+        pair_keys = [np.zeros(0, dtype=np.int64)]
+        for group in groups.values():
+            if len(group) > 1:
+                group = np.array(group, dtype=np.int64)
+                i1, i2 = np.triu_indices(len(group), k=1)
+                pair_keys.append(group[i1] * num_mentions + group[i2])
+        return np.concatenate(pair_keys)
+
 
 class Token:
     """
     Class representing a SemEval2010 Token.
+    Slotted, as documents hold many tokens: no per-instance dict, and the
+     classified corefs' dict is only created when first used.
     """
+    __slots__ = ('features', 'sentence_idx', 'document', 'pos_tag', 'morph_features', '_classified_corefs')
 
     def __init__(self, features, sentence_idx):
         self.features = features
         self.sentence_idx = sentence_idx
 
-        self.num_mention_starts = 0   # The number of mentions that start at this Token
-        self.num_mention_ends = 0     # The number of mentions that end at this Token
-
-        self.classified_corefs = {} # automatically classified corefs
-
         self.document = None
         self.pos_tag = None
         self.morph_features = None
+        self._classified_corefs = None
 
     def __getitem__(self, idx):
         return self.features[idx]
@@ -78,6 +135,15 @@ class Token:
     def __len__(self):
         return len(self.features)
 
+    @property
+    def classified_corefs(self):
+        """
+        Automatically classified corefs, by entity id.
+        """
+        if self._classified_corefs is None:
+            self._classified_corefs = dict()
+        return self._classified_corefs
+
     def key(self):
         """
         Used for comparing tokens' chronological orders.
@@ -109,24 +175,35 @@ class Mention:
     """
     A class representing a Mention in a document.
     May comprise several word tokens.
+    Slotted, with its full mention string only joined when first used.
     """
+    __slots__ = ('tokens', 'sentence_idx', 'document', 'char_span', 'entity_id', '_full_mention')
 
     def __init__(self, tokens):
         self.tokens = tokens
         self.sentence_idx = tokens[0].sentence_idx
 
-        self.full_mention = ' '.join([tok[IdxUtils.TOKEN] for tok in self.tokens])
         self.document = tokens[0].document
+        self.char_span = None   # (start, end) character offsets in the document's text, if known
+        self.entity_id = None   # gold entity, for mentions read from annotated corpora
+        self._full_mention = None
 
         # assert all tokens in the same document
-        assert (len(set([tok.document.id for tok in tokens])) == 1),\
+        assert all(tok.document is self.document for tok in tokens),\
                 "mention's tokens belong to different documents"
 
+    @property
+    def full_mention(self):
+        if self._full_mention is None:
+            self._full_mention = ' '.join([tok[IdxUtils.TOKEN] for tok in self.tokens])
+        return self._full_mention
+
 
 class MentionPair:
     """
     A class representing a coreferring mention-pair, and its features.
     """
+    __slots__ = ('m1', 'm2', 'document_id', 'sent_dist', 'token_dist')
 
     def __init__(self, m1, m2):
         self.m1 = m1
@@ -141,27 +218,45 @@ class MentionPair:
         self.token_dist = token_distance_between_tokens(m1.tokens[0], m2.tokens[0])
 
 
+class MentionPairs:
+    """
+    Columnar representation of a document's mention-pairs.
+    Pairs are stored as parallel arrays of mention indices (m1_idx[i] < m2_idx[i]),
+     alongside one array per pair feature, avoiding one Python object per pair.
+    Indexing returns a MentionPair view over the i-th pair.
+    """
+
+    def __init__(self, document, m1_idx, m2_idx):
+        assert len(m1_idx) == len(m2_idx),\
+                "mention indices must have the same length"
+
+        self.document = document
+        self.m1_idx = np.asarray(m1_idx, dtype=np.int64)
+        self.m2_idx = np.asarray(m2_idx, dtype=np.int64)
+
+        mentions = document.mentions
+        sentence_idx = np.array([m.sentence_idx for m in mentions], dtype=np.int64)
+        token_position = np.array([document.token_position(m.tokens[0]) for m in mentions], dtype=np.int64)
+        self.sent_dist = np.abs(sentence_idx[self.m2_idx] - sentence_idx[self.m1_idx])
+        self.token_dist = np.abs(token_position[self.m2_idx] - token_position[self.m1_idx])
+        self.mention_dist = self.m2_idx - self.m1_idx
+
+    def __len__(self):
+        return len(self.m1_idx)
+
+    def __getitem__(self, idx):
+        mentions = self.document.mentions
+        return MentionPair(mentions[self.m1_idx[idx]], mentions[self.m2_idx[idx]])
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+
 def token_distance_between_tokens(t1, t2):
     """
     Distance in tokens between the two given tokens.
     """
     assert t1.document.id == t2.document.id
-    # If t1 comes after t2, flip variables
-    if t1.key() > t2.key():
-        temp = t1
-        t1 = t2
-        t2 = temp
-
-    assert t1.sentence_idx <= t2.sentence_idx,\
-            "wrong order for tokens, t1 should appear before t2"
-
     document = t1.document
-    distance = 0
-    for i in range(t1.sentence_idx, t2.sentence_idx + 1):
-        distance += len(document.sentences[i])
-        if i == t1.sentence_idx:
-            distance -= t1.get_id()
-        if i == t2.sentence_idx:
-            distance -= len(document.sentences[i]) - t2.get_id()
-
-    return distance
+    return abs(document.token_position(t2) - document.token_position(t1))
@@ -0,0 +1,158 @@
+"""
+semeval_reader.py: streaming reader of SemEval-2010 coreference corpora.
+
+Column files hold one token per line, sentences separated by blank lines and
+ documents delimited by '#begin document <name>' and '#end document' lines.
+The last (COREF) column marks the gold mentions starting and ending at each
+ token, e.g. '(12', '12)', '(12)' or '(3|12)', and '_' for none.
+
+Documents are read one at a time, so corpora of any size are read in memory
+ bounded by their largest document, optionally through a memory-mapped file.
+"""
+
+import io
+import mmap
+from .semeval import Document, Mention, Token
+from .semeval_utils import IdxUtils, MentionUtils
+
+BEGIN_DOCUMENT = '#begin document'
+END_DOCUMENT = '#end document'
+NO_COREF = '_'
+
+
+def read_documents(path, encoding='utf-8', memory_map=False):
+    """
+    Yields each document of the given SemEval-2010 file, with its gold
+     mentions (see parse_coref), as a Document ready for api.cluster_mentions.
+    @arg memory_map Whether to read the file through a memory map, sharing the
+     OS page cache instead of copying the file through read buffers.
+    """
+    with open(path, 'rb') as file:
+        if memory_map:
+            if not file.seek(0, io.SEEK_END):
+                return      # empty files can't be memory-mapped
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for document in parse_documents(_mapped_lines(mapped, encoding)):
+                    yield document
+        else:
+            for document in parse_documents(io.TextIOWrapper(file, encoding=encoding)):
+                yield document
+
+
+def _mapped_lines(mapped, encoding):
+    for line in iter(mapped.readline, b''):
+        yield line.decode(encoding)
+
+
+def parse_documents(lines):
+    """
+    Yields each document of the given SemEval-2010 lines (e.g. a text file).
+    Lines outside '#begin document' and '#end document' make up a single
+     unnamed document, for files without delimiters.
+    Raises ValueError, with the line number, for malformed COREF columns.
+    """
+    doc, coref_parser, sentence_idx, token_count = None, None, 0, 0
+    for line_number, line in enumerate(lines, 1):
+        line = line.rstrip('\r\n')
+        if line.startswith(BEGIN_DOCUMENT):
+            if doc is not None:
+                yield coref_parser.close(line_number)
+            doc = Document(line[len(BEGIN_DOCUMENT):].strip())
+            coref_parser, sentence_idx, token_count = CorefParser(doc), 0, 0
+        elif line.startswith(END_DOCUMENT):
+            if doc is not None:
+                yield coref_parser.close(line_number)
+            doc = None
+        elif not line.strip():
+            if token_count > 0:
+                sentence_idx, token_count = sentence_idx + 1, 0
+        else:
+            if doc is None:
+                doc = Document('')
+                coref_parser, sentence_idx, token_count = CorefParser(doc), 0, 0
+            features = line.split('\t') if '\t' in line else line.split()
+            token = Token(features, sentence_idx)
+            doc.add_token(token)
+            coref_parser.add(token, features[IdxUtils.COREF], line_number)
+            token_count += 1
+
+    if doc is not None:
+        yield coref_parser.close(line_number + 1)
+
+
+def parse_coref(coref):
+    """
+    Parses a COREF column into (entity id, MentionUtils) tuples, one for each
+     mention starting and/or ending at its token.
+    """
+    if coref == NO_COREF or not coref:
+        return []
+    marks = list()
+    for mark in coref.split('|'):
+        starts, ends = mark.startswith('('), mark.endswith(')')
+        entity_id = mark[1 if starts else 0: -1 if ends else len(mark)]
+        if not (starts or ends) or not entity_id.isdigit():
+            raise ValueError("Malformed COREF mark '{}'".format(mark))
+        if starts and ends:
+            marks.append((int(entity_id), MentionUtils.START_END))
+        else:
+            marks.append((int(entity_id), MentionUtils.START if starts else MentionUtils.END))
+    return marks
+
+
+class CorefParser(object):
+    """
+    Builds a document's gold mentions from its tokens' COREF columns, matching
+     each mention's end with the latest open mention of the same entity.
+    """
+
+    def __init__(self, doc):
+        self.doc = doc
+        self.open_mentions = dict()     # entity id -> [(first token index, line number)], latest last
+        self.spans = list()             # (first token index, end token index, entity id)
+
+    def add(self, token, coref, line_number):
+        token_idx = len(self.doc.tokens) - 1
+        try:
+            marks = parse_coref(coref)
+        except ValueError as err:
+            raise ValueError('{} at line {}.'.format(err, line_number))
+
+        for entity_id, mark in marks:
+            if mark == MentionUtils.START_END:
+                self.spans.append((token_idx, token_idx + 1, entity_id))
+            elif mark == MentionUtils.START:
+                self.open_mentions.setdefault(entity_id, list()).append((token_idx, line_number))
+            elif not self.open_mentions.get(entity_id):
+                raise ValueError("Unmatched end of entity {}'s mention at line {}.".format(entity_id, line_number))
+            else:
+                start, _ = self.open_mentions[entity_id].pop()
+                self.spans.append((start, token_idx + 1, entity_id))
+
+    def close(self, line_number):
+        """
+        Adds the document's mentions, ordered by first token and longest first.
+        @returns the document
+        """
+        for entity_id, starts in self.open_mentions.items():
+            if starts:
+                raise ValueError("Unmatched start of entity {}'s mention at line {}, in document ending at line {}."
+                                 .format(entity_id, starts[-1][1], line_number))
+
+        self.spans.sort(key=lambda span: (span[0], -span[1]))
+        for start, end, entity_id in self.spans:
+            mention = Mention(self.doc.tokens[start: end])
+            mention.entity_id = entity_id
+            self.doc.mentions.append(mention)
+        return self.doc
+
+
+def gold_clusters(doc):
+    """
+    The document's gold entities, as sets of mention indices, in order of
+     their first mention.
+    """
+    clusters = dict()
+    for mention_idx, mention in enumerate(doc.mentions):
+        clusters.setdefault(mention.entity_id, list()).append(mention_idx)
+    return [set(cluster) for cluster in sorted(clusters.values(), key=lambda cluster: cluster[0])]
@@ -0,0 +1,125 @@
+"""
+serving.py: prefork serving of a WSGI application, without external services.
+
+The parent process binds the listening socket and loads the state shared by all
+ workers, then forks the workers, which share that state copy-on-write and
+ accept connections from the same socket. Workers that die are restarted.
+"""
+
+import os
+import gc
+import sys
+import time
+import signal
+import socket
+import logging
+import numpy as np
+from werkzeug.serving import make_server
+
+logger = logging.getLogger(__name__)
+
+# Workers exiting sooner than this after starting are restarted with a delay
+MIN_WORKER_LIFETIME = 1.
+
+
+def bind_socket(host='127.0.0.1', port=5000, backlog=128):
+    """
+    Returns a listening socket, bound to the given address (port 0 binds to
+     any free port, see socket.getsockname).
+    """
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def serve(app, sock, workers=None, preload=None, post_fork=None, threaded=False):
+    """
+    Serves the WSGI app from the given socket with the given number of worker
+     processes (default: one per CPU), until interrupted (SIGINT or SIGTERM).
+    @arg preload Function loading the state shared by all workers, called once
+     in the parent process before forking.
+    @arg post_fork Function loading each worker's own state (e.g. anything
+     holding threads or sessions, which don't survive a fork), called in each
+     worker before serving.
+    @arg threaded Whether each worker handles concurrent requests in threads.
+    """
+    workers = workers or os.cpu_count() or 1
+    if preload is not None:
+        preload()
+
+    # Keep the preloaded objects out of the garbage collector's generations,
+    # so that collections in the workers don't write to their shared pages
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+
+    children = dict()   # pid -> start time
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in list(children):
+            _kill(pid, signal.SIGTERM)
+
+    previous_handlers = {signum: signal.signal(signum, stop) for signum in (signal.SIGINT, signal.SIGTERM)}
+    try:
+        for _ in range(workers):
+            _spawn(children, app, sock, post_fork, threaded)
+        logger.info('Serving on %s with %d workers.', sock.getsockname(), workers)
+
+        while children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            started = children.pop(pid, None)
+            if started is None or stopping:
+                continue
+
+            logger.warning('Worker %d exited with status %d, restarting it.', pid, status)
+            if time.monotonic() - started < MIN_WORKER_LIFETIME:
+                time.sleep(MIN_WORKER_LIFETIME)
+            if not stopping:
+                _spawn(children, app, sock, post_fork, threaded)
+    finally:
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+        if hasattr(gc, 'unfreeze'):
+            gc.unfreeze()
+
+
+def _kill(pid, signum):
+    try:
+        os.kill(pid, signum)
+    except ProcessLookupError:
+        pass
+
+
+def _spawn(children, app, sock, post_fork, threaded):
+    pid = os.fork()
+    if pid != 0:
+        children[pid] = time.monotonic()
+        return
+
+    # Worker process: never returns to the caller's code
+    exit_code = 0
+    try:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)     # the parent stops workers with SIGTERM
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        np.random.seed()    # don't share the parent's random state
+        if post_fork is not None:
+            post_fork()
+        host, port = sock.getsockname()[:2]
+        server = make_server(host, port, app, threaded=threaded, fd=sock.fileno())
+        server.serve_forever()
+    except BaseException:
+        logger.exception('Worker %d failed.', os.getpid())
+        exit_code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(exit_code)
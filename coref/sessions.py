@@ -0,0 +1,243 @@
+"""
+sessions.py: incremental (online) coreference resolution of growing documents.
+
+A session keeps its document's tokens and mentions, each mention's model
+ inputs (encodings, with split models), and the coreferent mention-pairs.
+Text appended to a session only adds mentions after the existing ones, whose
+ pairs (and thus closest antecedents) don't change. Only the pairs involving
+ the new mentions are scored, and the new mentions joined to the clusters.
+"""
+
+import time
+import uuid
+import threading
+import numpy as np
+from collections import OrderedDict
+from .semeval import Document, Mention, MentionPairs, Token
+from .data import process_mention_pairs_to_distance_features, process_mentions_to_indices
+from .clustering_utils import Link
+from . import metrics
+
+
+# Rough memory footprint of each Token and Mention object, in bytes
+TOKEN_BYTES = 250
+MENTION_BYTES = 200
+
+
+class Session(object):
+    """
+    A document resolved incrementally with the given model, linking each
+     mention to its closest antecedent scored above the threshold, as
+     clustering.cluster_by_closest_antecedent.
+    """
+
+    def __init__(self, mem_cache, model_key, automatic, max_mention_length=50, threshold=0.5, deduplicate=False):
+        self.mem_cache = mem_cache
+        self.deduplicate = deduplicate
+        self.model_key = model_key
+        self.automatic = automatic
+        self.max_mention_length = max_mention_length
+        self.threshold = threshold
+
+        self.document = Document('session-document')
+        self.document.text = ''         # the appended texts, one per line
+        self.mention_inputs = None      # [m1_inputs, m2_inputs], one row per mention
+        self.coreferent_pairs = list()  # (m1_idx, m2_idx, scores) of each append, above the threshold
+        self.links = np.zeros(shape=(0,), dtype=int)
+        self.clusters = OrderedDict()   # cluster root -> mentions, ordered by last mention
+        self.roots = list()             # each mention's cluster root
+
+        self.lock = threading.Lock()
+        self.last_access = time.monotonic()
+        self.num_bytes = 0
+
+    def append(self, fragment):
+        """
+        Appends the given document's tokens, as new sentences, and its mentions,
+         scoring only the mention-pairs whose second mention is new.
+        The fragment's text is appended to the session's text on a new line, its
+         mentions' character spans being offset accordingly.
+        The session is left unchanged if scoring fails.
+        @returns number of new mentions
+        """
+        num_old_tokens, num_old_mentions = len(self.document.tokens), len(self.document.mentions)
+        separator = '\n' if self.document.text and fragment.text else ''
+        self._merge(fragment, len(self.document.text) + len(separator))
+        try:
+            num_new_mentions = self._score_new_mentions(num_old_mentions)
+        except Exception:
+            self._truncate(num_old_tokens, num_old_mentions)
+            raise
+        self.document.text += separator + (fragment.text or '')
+        self._update_size()
+        return num_new_mentions
+
+    def _score_new_mentions(self, num_old_mentions):
+        num_mentions = len(self.document.mentions)
+        if num_mentions == num_old_mentions:
+            return 0
+
+        tokenizer = self.mem_cache.get_tokenizer(self.model_key)
+        sequence_cache = self.mem_cache.get_sequence_cache(self.model_key)
+        X_new = process_mentions_to_indices(
+            self.document.mentions[num_old_mentions:], tokenizer, self.max_mention_length, sequence_cache)
+        new_inputs = self.mem_cache.encode_mentions(self.model_key, X_new, deduplicate=self.deduplicate)
+        if self.mention_inputs is None:
+            mention_inputs = new_inputs
+        elif new_inputs[0] is new_inputs[1]:
+            # Shared encoder or unsplit model, keep a single copy
+            mention_inputs = [np.concatenate([self.mention_inputs[0], new_inputs[0]])] * 2
+        else:
+            mention_inputs = [np.concatenate([old, new]) for old, new in zip(self.mention_inputs, new_inputs)]
+
+        # Pairs (m1, m2) of every new mention m2 with each of its antecedents m1
+        new_mentions = np.arange(num_old_mentions, num_mentions)
+        m2_idx = np.repeat(new_mentions, new_mentions)
+        pair_offsets = np.cumsum(new_mentions) - new_mentions
+        m1_idx = np.arange(len(m2_idx)) - np.repeat(pair_offsets, new_mentions)
+        X_scalar = process_mention_pairs_to_distance_features(MentionPairs(self.document, m1_idx, m2_idx))
+        with metrics.timed('predict'):
+            scores = self.mem_cache.score_pairs(
+                self.model_key, mention_inputs, m1_idx, m2_idx, X_scalar, deduplicate=self.deduplicate).reshape(-1)
+
+        self.mention_inputs = mention_inputs
+        coreferent = scores > self.threshold
+        self.coreferent_pairs.append((m1_idx[coreferent], m2_idx[coreferent], scores[coreferent]))
+        self._link(num_old_mentions, num_mentions, m1_idx[coreferent], m2_idx[coreferent])
+        return num_mentions - num_old_mentions
+
+    def _merge(self, fragment, text_offset):
+        sentence_offset = max(self.document.sentences) + 1 if self.document.sentences else 0
+        new_tokens = dict()
+        for token in fragment.tokens:
+            new_token = Token([token.get_id(), token.get_string()], token.sentence_idx + sentence_offset)
+            self.document.add_token(new_token)
+            new_tokens[id(token)] = new_token
+        for mention in fragment.mentions:
+            new_mention = Mention([new_tokens[id(token)] for token in mention.tokens])
+            if mention.char_span is not None:
+                start, end = mention.char_span
+                new_mention.char_span = (start + text_offset, end + text_offset)
+            self.document.mentions.append(new_mention)
+
+    def _truncate(self, num_tokens, num_mentions):
+        document = self.document
+        for token in document.tokens[num_tokens:]:
+            document.sentences.pop(token.sentence_idx, None)
+            document.sentence_offsets.pop(token.sentence_idx, None)
+        del document.tokens[num_tokens:]
+        del document.mentions[num_mentions:]
+
+    def _link(self, num_old_mentions, num_mentions, m1_idx, m2_idx):
+        """
+        Links each new mention to its closest coreferent antecedent, and adds it
+         to that antecedent's cluster (or a new one). Antecedents' clusters are
+         final, so each mention is clustered in constant time.
+        """
+        new_links = np.full(num_mentions - num_old_mentions, Link.NO_ANTECEDENT, dtype=int)
+        np.maximum.at(new_links, m2_idx - num_old_mentions, m1_idx)
+        self.links = np.concatenate([self.links, new_links])
+
+        for mention_idx, antecedent in enumerate(new_links.tolist(), num_old_mentions):
+            root = mention_idx if antecedent == Link.NO_ANTECEDENT else self.roots[antecedent]
+            self.roots.append(root)
+            self.clusters.setdefault(root, list()).append(mention_idx)
+            self.clusters.move_to_end(root)
+
+    def _update_size(self):
+        mention_inputs = self.mention_inputs or []
+        arrays = list({id(array): array for array in mention_inputs}.values())
+        arrays += [array for pairs in self.coreferent_pairs for array in pairs] + [self.links]
+        self.num_bytes = sum(array.nbytes for array in arrays) \
+            + TOKEN_BYTES * len(self.document.tokens) + MENTION_BYTES * len(self.document.mentions) \
+            + len(self.document.text)
+
+    def serialize(self):
+        """
+        JSON serializable representation of the session's mentions, their
+         character spans in the session's text, the text itself (the appended
+         normalized texts, one per line), and clusters, as api.serialize_clusters.
+        """
+        return {
+            'mentions': [m.full_mention for m in self.document.mentions],
+            'offsets': [list(m.char_span) if m.char_span is not None else None for m in self.document.mentions],
+            'text': self.document.text,
+            'clusters': [list(cluster) for cluster in self.clusters.values()],
+        }
+
+
+class SessionNotFound(KeyError):
+    """
+    Raised for sessions which don't exist, or were evicted.
+    """
+
+
+class SessionStore(object):
+    """
+    Holds sessions by id, evicting those idle for longer than idle_timeout
+     seconds, and the least recently used ones while all sessions' memory
+     exceeds max_bytes.
+    """
+
+    def __init__(self, max_bytes=256 * 2**20, idle_timeout=1800.):
+        self.max_bytes = max_bytes
+        self.idle_timeout = idle_timeout
+        self.sessions = OrderedDict()   # id -> session, least recently used first
+        self.lock = threading.Lock()
+        self.stats = {'created': 0, 'idle_evictions': 0, 'memory_evictions': 0}
+
+    def add(self, session):
+        session_id = uuid.uuid4().hex
+        with self.lock:
+            self.sessions[session_id] = session
+            self.stats['created'] += 1
+            self._evict()
+        return session_id
+
+    def get(self, session_id):
+        """
+        Returns the given session, raising SessionNotFound if it doesn't exist
+         or was evicted.
+        """
+        with self.lock:
+            self._evict()
+            if session_id not in self.sessions:
+                raise SessionNotFound(session_id)
+            session = self.sessions[session_id]
+            session.last_access = time.monotonic()
+            self.sessions.move_to_end(session_id)
+            return session
+
+    def remove(self, session_id):
+        with self.lock:
+            if self.sessions.pop(session_id, None) is None:
+                raise SessionNotFound(session_id)
+
+    def update(self, session_id):
+        """
+        Accounts for the given session's new size, evicting sessions if needed.
+        """
+        with self.lock:
+            if session_id in self.sessions:
+                self.sessions[session_id].last_access = time.monotonic()
+            self._evict()
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['sessions'] = len(self.sessions)
+            stats['bytes'] = sum(session.num_bytes for session in self.sessions.values())
+        return stats
+
+    def _evict(self):
+        now = time.monotonic()
+        for session_id, session in list(self.sessions.items()):
+            if now - session.last_access > self.idle_timeout:
+                del self.sessions[session_id]
+                self.stats['idle_evictions'] += 1
+
+        num_bytes = sum(session.num_bytes for session in self.sessions.values())
+        while self.sessions and num_bytes > self.max_bytes:
+            _, session = self.sessions.popitem(last=False)
+            num_bytes -= session.num_bytes
+            self.stats['memory_evictions'] += 1
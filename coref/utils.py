@@ -2,8 +2,22 @@ import sys, os, io
 import numpy as np
 import warnings
 import pickle
+import threading
+import time
+import logging
+import multiprocessing
+from collections import OrderedDict, deque
 from keras.models import load_model
 import tensorflow as tf
+from .models import SplitMentionPairModel, verify_split_model, warm_up
+from .scheduler import MicroBatchScheduler
+from .vocab import Vocabulary
+
+logger = logging.getLogger(__name__)
+
+# Held while loading any model: Keras builds models into the shared default TF
+# graph and session, which concurrent loads would corrupt
+MODEL_LOAD_LOCK = threading.Lock()
 
 
 def split_train_dataset(X_list, Y, test_ratio = 0.2):
@@ -60,44 +74,397 @@ def bin_scalar(dist, bins):
     raise RuntimeWarning("Coudln't bin scalar '{}'.".format(dist))
 
 
+def bin_scalars(dists, bins):
+    """
+    Vectorized version of bin_scalar, bins a whole array of scalars at once.
+    """
+    dists = np.asarray(dists)
+    binned = np.searchsorted(bins, dists, side='right') - 1
+    out_of_range = (binned < 0) | (binned >= len(bins) - 1)
+    if out_of_range.any():
+        raise RuntimeWarning("Coudln't bin scalar '{}'.".format(dists[out_of_range][0]))
+    return binned
+
+
+def unique_rows(X_list):
+    """
+    Finds the distinct rows of a dataset given as a list of feature arrays, with
+     one row per sample in each array.
+    @returns (unique_indices, inverse) such that, for each feature array X,
+     X[unique_indices][inverse] == X
+    """
+    num_rows = len(X_list[0])
+    row_bytes = np.hstack([
+        np.ascontiguousarray(X).reshape(num_rows, -1).view(np.uint8) for X in X_list
+    ])
+    rows = np.ascontiguousarray(row_bytes).view(np.dtype((np.void, row_bytes.shape[1]))).ravel()
+    _, unique_indices, inverse = np.unique(rows, return_index=True, return_inverse=True)
+    return unique_indices, inverse.reshape(-1)
+
+
+def unique_pairs(mention_inputs, m1_idx, m2_idx, X_scalar):
+    """
+    Finds the distinct mention-pairs: those of mentions with distinct inputs, or
+     with distinct (binned) distance features. Each pair is keyed by a single
+     int64, from its mentions' ids (see unique_rows, over the mentions' rows
+     rather than the pairs') and the ids of its features' values.
+    @arg mention_inputs [m1_inputs, m2_inputs], one row per mention
+    @returns (unique_indices, inverse) as unique_rows, over the pairs
+    """
+    mention_arrays = list({id(inputs): inputs for inputs in mention_inputs}.values())
+    mention_ids = unique_rows(mention_arrays)[1]
+    num_ids = int(mention_ids.max()) + 1 if len(mention_ids) > 0 else 0
+
+    columns, dims = [mention_ids[m1_idx], mention_ids[m2_idx]], [num_ids, num_ids]
+    for feature in np.asarray(X_scalar).reshape(len(m1_idx), -1).T:
+        values, value_ids = np.unique(feature, return_inverse=True)
+        columns.append(value_ids.reshape(-1))
+        dims.append(len(values))
+
+    keys = np.ravel_multi_index(columns, dims)
+    _, unique_indices, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    return unique_indices, inverse.reshape(-1)
+
+
+def bounded_imap(function, items, args=(), workers=0, window=None):
+    """
+    Yields function(item, *args) for each item, in order, in a pool of the given
+     number of forked processes (0 calls it in this process). Only window items
+     (default: two per process) are in flight at once, so items are consumed
+     (e.g. read from disk) only as fast as they're processed.
+    """
+    if workers <= 0:
+        for item in items:
+            yield function(item, *args)
+        return
+
+    window = window or 2 * workers
+    pool = multiprocessing.get_context('fork').Pool(workers)
+    try:
+        pending = deque()
+        for item in items:
+            pending.append(pool.apply_async(function, (item,) + tuple(args)))
+            if len(pending) >= window:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
 def load_tokenizer(path):
     with open(path, 'rb') as f:
         tokenizer = pickle.load(f)
     return tokenizer
 
 
+class LRUCache(object):
+    """
+    Bounded key-value cache, evicting the least recently used entries.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        if key not in self.entries:
+            return default
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+
+class SequenceCache(object):
+    """
+    Caches a tokenizer's text to sequence conversions, shared across requests.
+    """
+
+    def __init__(self, tokenizer, max_size=100000):
+        self.tokenizer = tokenizer
+        self.cache = LRUCache(max_size)
+        self.lock = threading.Lock()
+
+    def texts_to_sequences(self, texts):
+        with self.lock:
+            sequences = [self.cache.get(text) for text in texts]
+            missing = list(OrderedDict.fromkeys(
+                text for text, seq in zip(texts, sequences) if seq is None
+            ))
+            if missing:
+                computed = dict(zip(missing, self.tokenizer.texts_to_sequences(missing)))
+                for text in missing:
+                    self.cache.put(text, computed[text])
+                sequences = [computed[text] if seq is None else seq for text, seq in zip(texts, sequences)]
+        return sequences
+
+
 class MemCache(object):
     """
     Keeps an index/cache of the used tokenizers and models,
      preventing repeated loads.
     """
 
-    def __init__(self, data_path):
+    def __init__(self, data_path, sequence_cache_size=100000, split_models=False):
+        """
+        @arg split_models Whether to split loaded models into a mention encoder
+         and a pair-scoring head (see models.SplitMentionPairModel).
+        """
         self.data_path = data_path
+        self.sequence_cache_size = sequence_cache_size
+        self.split_models_enabled = split_models
         self.tokenizers = dict()
+        self.sequence_caches = dict()
         self.models = dict()
+        self.split_models = dict()
         self.model_graphs = dict()
+        self.stats = dict()
+        self.stats_lock = threading.Lock()
+        self.micro_batching = None
+        self.schedulers = dict()
+        self.load_locks = dict()    # (kind, key) -> lock held while loading, but for models
+        self.load_status = dict()   # (kind, key) -> 'loading' or 'failed'
+        self.load_locks_lock = threading.Lock()
+
+    def _load(self, kind, key, loaded, load, lock=None):
+        """
+        Loads the given resource once, even if requested by concurrent threads,
+         which wait for the load in progress.
+        @arg lock Lock held while loading, by default one per resource so that
+         loads of other keys aren't blocked.
+        """
+        if lock is None:
+            with self.load_locks_lock:
+                lock = self.load_locks.setdefault((kind, key), threading.Lock())
+        with lock:
+            if key not in loaded:
+                self.load_status[(kind, key)] = 'loading'
+                try:
+                    load(key)
+                except Exception:
+                    self.load_status[(kind, key)] = 'failed'
+                    raise
+                self.load_status.pop((kind, key), None)
+        return loaded[key]
 
     def get_tokenizer(self, key):
-        if key not in self.tokenizers:
+        if key in self.tokenizers:
+            return self.tokenizers[key]
+        return self._load('tokenizer', key, self.tokenizers, self._load_tokenizer)
+
+    def _load_tokenizer(self, key):
+        """
+        Loads the memory-mapped vocabulary (see vocab.py) if one was converted,
+         or else the pickled Keras Tokenizer.
+        """
+        vocabulary_path = self.data_path + '/tokenizer.{}.vocab'.format(key)
+        if os.path.exists(vocabulary_path):
+            self.tokenizers[key] = Vocabulary(vocabulary_path)
+        else:
             self.tokenizers[key] = load_tokenizer(self.data_path + '/tokenizer.{}.pkl'.format(key))
-        return self.tokenizers[key]
+
+    def get_sequence_cache(self, key):
+        if key not in self.sequence_caches:
+            self.sequence_caches[key] = SequenceCache(self.get_tokenizer(key), self.sequence_cache_size)
+        return self.sequence_caches[key]
 
     def get_model(self, key):
-        if key not in self.models:
+        """
+        Returns the given model, loading it on first use.
+        Models are loaded one at a time (see MODEL_LOAD_LOCK).
+        """
+        if key in self.models:
+            return self.models[key]
+        return self._load('model', key, self.models, self._load_model, MODEL_LOAD_LOCK)
+
+    def _load_model(self, key):
+        start = time.monotonic()
+        graph = tf.get_default_graph()
+        with graph.as_default():
             model = load_model(self.data_path + '/models/{}.h5'.format(key))
             model._make_predict_function()  # Initialize predict function in sync environment
-            self.models[key] = model
-            self.model_graphs[key] = tf.get_default_graph()
-        return self.models[key]
+            self.model_graphs[key] = graph
+            if self.split_models_enabled:
+                self._split_model(key, model)
+            warm_up(model, self.split_models.get(key))
+
+        # Only visible to other threads once split and warmed up
+        self.models[key] = model
+        logger.info('Loaded model %s in %.1fs.', key, time.monotonic() - start)
 
-    def predict(self, model_key, X):
+    def get_status(self, tokenizer_keys=(), model_keys=()):
+        """
+        Loading status ('loaded', 'loading', 'failed' or 'not_loaded') of the
+         given (and of all loaded) tokenizers and models.
+        """
+        def status(kind, key, loaded):
+            return 'loaded' if key in loaded else self.load_status.get((kind, key), 'not_loaded')
+        return {
+            'tokenizers': {key: status('tokenizer', key, self.tokenizers)
+                           for key in set(tokenizer_keys) | set(self.tokenizers)},
+            'models': {key: status('model', key, self.models) for key in set(model_keys) | set(self.models)},
+        }
+
+    def _split_model(self, key, model):
+        try:
+            split_model = SplitMentionPairModel(model)
+        except ValueError as err:
+            logger.warning('Model %s could not be split, using the full model: %s', key, err)
+            return
+
+        if verify_split_model(model, split_model):
+            self.split_models[key] = split_model
+        else:
+            logger.warning('Split model %s does not match the full model, using the full model.', key)
+
+    def predict(self, model_key, X, deduplicate=False):
         """
         See Keras' issue #2397.
         https://github.com/keras-team/keras/issues/2397
+        @arg deduplicate Whether to only feed the model with distinct rows of X,
+         scattering the predictions back to all rows.
+        """
+        inverse = None
+        if deduplicate and len(X[0]) > 0:
+            unique_indices, inverse = unique_rows(X)
+            X = [x[unique_indices] for x in X]
+        return self._predict(model_key, self.get_model(model_key), X, inverse)
+
+    def predict_pairs(self, model_key, X_mentions, m1_idx, m2_idx, X_scalar, deduplicate=False):
+        """
+        Scores the mention-pairs given by indices into the mentions' token indices,
+         X_mentions, and the pairs' distance features, X_scalar.
+        With a split model, each mention is encoded once and only the pair-scoring
+         head runs once per mention-pair.
+        """
+        mention_inputs = self.encode_mentions(model_key, X_mentions, deduplicate)
+        return self.score_pairs(model_key, mention_inputs, m1_idx, m2_idx, X_scalar, deduplicate)
+
+    def encode_mentions(self, model_key, X_mentions, deduplicate=False):
+        """
+        Per-mention inputs of the pair-scoring model: the mentions' encodings
+         with a split model, or else their token indices.
+        @returns [m1_inputs, m2_inputs], one row per mention
         """
+        self.get_model(model_key)
+        if model_key not in self.split_models:
+            return [X_mentions, X_mentions]
+
+        split_model = self.split_models[model_key]
+        if deduplicate and len(X_mentions) > 0:
+            unique_indices, inverse = unique_rows([X_mentions])
+            with self.model_graphs[model_key].as_default():
+                encodings = split_model.encode(X_mentions[unique_indices])
+            return [enc[inverse] for enc in encodings]
+
         with self.model_graphs[model_key].as_default():
-            return self.models[model_key].predict(X)
+            return split_model.encode(X_mentions)
+
+    def score_pairs(self, model_key, mention_inputs, m1_idx, m2_idx, X_scalar, deduplicate=False):
+        """
+        Scores the given mention-pairs from the per-mention inputs returned by
+         encode_mentions, which may thus be reused across calls.
+
+        @arg deduplicate Whether to only score the distinct mention-pairs (see
+         unique_pairs), scattering the predictions back to all pairs.
+        """
+        model = self.get_model(model_key)
+        if model_key in self.split_models:
+            model = self.split_models[model_key].head
+
+        m1_idx, m2_idx = np.asarray(m1_idx, dtype=np.int64), np.asarray(m2_idx, dtype=np.int64)
+        inverse = None
+        if deduplicate and len(m1_idx) > 0:
+            unique_indices, inverse = unique_pairs(mention_inputs, m1_idx, m2_idx, X_scalar)
+            m1_idx, m2_idx, X_scalar = m1_idx[unique_indices], m2_idx[unique_indices], X_scalar[unique_indices]
+
+        X = [mention_inputs[0][m1_idx], mention_inputs[1][m2_idx], X_scalar]
+        return self._predict(model_key, model, X, inverse)
+
+    def _predict(self, model_key, model, X, inverse=None):
+        """
+        Predicts the given rows, scattering the predictions back to all rows by
+         the given inverse, if deduplicated (see unique_rows).
+        """
+        num_rows = len(X[0]) if inverse is None else len(inverse)
+        if num_rows == 0:
+            return np.zeros(shape=(0, 1), dtype=np.float32)
+
+        self._update_stats(model_key, num_rows, len(X[0]))
+
+        if self.micro_batching is not None:
+            predictions = self._get_scheduler(model_key, model).predict(X)
+        else:
+            with self.model_graphs[model_key].as_default():
+                predictions = model.predict(X)
+
+        if inverse is not None:
+            predictions = predictions[inverse]
+        return predictions
+
+    def enable_micro_batching(self, max_batch_size=8192, max_latency=0.005):
+        """
+        Batches the predictions of concurrent requests to the same model, see
+         scheduler.MicroBatchScheduler.
+        """
+        self.micro_batching = {'max_batch_size': max_batch_size, 'max_latency': max_latency}
+
+    def _get_scheduler(self, model_key, model):
+        """
+        The scheduler of the given model object, so that a split model's head
+         (see score_pairs) and full model don't share one. Its predict closure
+         keeps the model alive, thus its id isn't reused.
+        """
+        with self.stats_lock:
+            scheduler_key = (model_key, id(model))
+            if scheduler_key not in self.schedulers:
+                graph = self.model_graphs[model_key]
+                def predict(X):
+                    with graph.as_default():
+                        return model.predict(X)
+                name = model_key
+                if model_key in self.split_models and model is self.split_models[model_key].head:
+                    name = model_key + '/head'
+                self.schedulers[scheduler_key] = (name, MicroBatchScheduler(predict, **self.micro_batching))
+            return self.schedulers[scheduler_key][1]
+
+    def get_scheduler_stats(self):
+        """
+        Queue depth and batch size statistics of each model's scheduler, keyed
+         by model key ('<key>/head' for split models' heads).
+        """
+        with self.stats_lock:
+            schedulers = list(self.schedulers.values())
+        return {name: scheduler.get_stats() for name, scheduler in schedulers}
+
+    def _update_stats(self, model_key, num_rows, num_predicted_rows):
+        with self.stats_lock:
+            stats = self.stats.setdefault(model_key, {'calls': 0, 'rows': 0, 'predicted_rows': 0})
+            stats['calls'] += 1
+            stats['rows'] += num_rows
+            stats['predicted_rows'] += num_predicted_rows
+
+    def get_stats(self, model_key):
+        """
+        Prediction statistics of the given model, including the ratio of rows
+         skipped by deduplication.
+        """
+        with self.stats_lock:
+            stats = dict(self.stats.get(model_key, {'calls': 0, 'rows': 0, 'predicted_rows': 0}))
+        stats['dedup_ratio'] = 1 - stats['predicted_rows'] / stats['rows'] if stats['rows'] else 0.
+        return stats
 
 
 class Logger(object):
@@ -0,0 +1,224 @@
+"""
+vocab.py: compact, memory-mapped vocabularies, replacing pickled Keras
+ Tokenizers for text to sequence conversion.
+
+A vocabulary file holds the tokenizer's word index as a table of UTF-8 strings
+ sorted by their bytes, along with each word's index, and an open addressing
+ hash index (crc32, linear probing) into that table. Files are memory-mapped
+ read-only, so processes using the same file share its pages.
+
+Layout (little-endian):
+    header      magic, number of words (size), number of hash buckets, config length
+    config      JSON with the tokenizer's filters, lower, split, num_words and oov_token
+    offsets     uint32 [size + 1], each word's start in the string table
+    indices     uint32 [size], each word's index (as in word_index)
+    buckets     uint32 [num_buckets], position in the table + 1, or 0 if empty
+    strings     UTF-8 bytes of the sorted words
+
+Usage: python -m coref.vocab tokenizer.pkl [output.vocab]
+"""
+
+import sys
+import json
+import mmap
+import zlib
+import struct
+import pickle
+import numpy as np
+
+
+MAGIC = b'CRFVOCB1'
+HEADER = struct.Struct('<8sQQQ')
+
+
+def text_to_word_sequence(text, filters, lower, split):
+    """
+    Splits the text into words, as keras.preprocessing.text.text_to_word_sequence.
+    """
+    if lower:
+        text = text.lower()
+    text = text.translate(str.maketrans(filters, split * len(filters)))
+    return [word for word in text.split(split) if word]
+
+
+def _align(offset, alignment=8):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def write_vocabulary(tokenizer, path):
+    """
+    Writes the given Keras Tokenizer's word index and text processing options
+     as a vocabulary file.
+    """
+    if sys.byteorder != 'little':
+        raise ValueError('Vocabulary files are only supported on little-endian platforms.')
+    if getattr(tokenizer, 'char_level', False):
+        raise ValueError('Character-level tokenizers are not supported.')
+
+    words = sorted(tokenizer.word_index, key=lambda word: word.encode('utf-8'))
+    encoded = [word.encode('utf-8') for word in words]
+    config = json.dumps({
+        'filters': tokenizer.filters,
+        'lower': tokenizer.lower,
+        'split': tokenizer.split,
+        'num_words': tokenizer.num_words,
+        'oov_token': getattr(tokenizer, 'oov_token', None),
+    }).encode('utf-8')
+
+    offsets = np.zeros(len(words) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(word) for word in encoded])
+    indices = np.array([tokenizer.word_index[word] for word in words], dtype=np.int64)
+    if offsets[-1] >= 2**32 or (len(indices) and indices.max() >= 2**32):
+        raise ValueError('Vocabulary too large, its strings and indices must fit in 32 bits.')
+    offsets, indices = offsets.astype('<u4'), indices.astype('<u4')
+
+    num_buckets = 1
+    while num_buckets < 2 * len(words):
+        num_buckets *= 2
+    buckets = np.zeros(num_buckets, dtype='<u4')
+    for position, word in enumerate(encoded):
+        bucket = zlib.crc32(word) & (num_buckets - 1)
+        while buckets[bucket]:
+            bucket = (bucket + 1) & (num_buckets - 1)
+        buckets[bucket] = position + 1
+
+    with open(path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, len(words), num_buckets, len(config)))
+        file.write(config)
+        for array in (offsets, indices, buckets):
+            file.write(b'\0' * (_align(file.tell()) - file.tell()))
+            file.write(array.tobytes())
+        file.write(b''.join(encoded))
+
+
+class Vocabulary(object):
+    """
+    Read-only, memory-mapped vocabulary, with the text to sequence conversion
+     of the Keras Tokenizer it was written from (see write_vocabulary).
+    """
+
+    def __init__(self, path):
+        if sys.byteorder != 'little':
+            raise ValueError('Vocabulary files are only supported on little-endian platforms.')
+        with open(path, 'rb') as file:
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.size, self.num_buckets, config_length = HEADER.unpack_from(self.mmap)
+        if magic != MAGIC:
+            raise ValueError('{} is not a vocabulary file.'.format(path))
+        offset = HEADER.size
+        config = json.loads(self.mmap[offset: offset + config_length].decode('utf-8'))
+        offset += config_length
+
+        self.filters = config['filters']
+        self.lower = config['lower']
+        self.split = config['split']
+        self.num_words = config['num_words']
+        self.oov_token = config['oov_token']
+
+        view = memoryview(self.mmap)
+        self.arrays = list()
+        self.offsets, offset = self._array(view, offset, 'I', self.size + 1)
+        self.indices, offset = self._array(view, offset, 'I', self.size)
+        self.buckets, offset = self._array(view, offset, 'I', self.num_buckets)
+        self.strings_offset = offset
+
+        self.oov_index = self.get(self.oov_token) if self.oov_token is not None else None
+
+    def _array(self, view, offset, format, length):
+        offset = _align(offset)
+        array = view[offset: offset + length * struct.calcsize(format)].cast(format)
+        self.arrays.append(array)
+        return array, offset + length * struct.calcsize(format)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, word):
+        return self.get(word) is not None
+
+    def word_at(self, position):
+        """
+        Returns the word at the given position of the sorted string table.
+        """
+        start = self.strings_offset + self.offsets[position]
+        end = self.strings_offset + self.offsets[position + 1]
+        return self.mmap[start: end].decode('utf-8')
+
+    def get(self, word, default=None):
+        """
+        Returns the word's index, as Tokenizer.word_index.get.
+        """
+        encoded = word.encode('utf-8')
+        mask = self.num_buckets - 1
+        bucket = zlib.crc32(encoded) & mask
+        while True:
+            entry = self.buckets[bucket]
+            if entry == 0:
+                return default
+            start = self.strings_offset + self.offsets[entry - 1]
+            end = self.strings_offset + self.offsets[entry]
+            if end - start == len(encoded) and self.mmap[start: end] == encoded:
+                return self.indices[entry - 1]
+            bucket = (bucket + 1) & mask
+
+    def texts_to_sequences(self, texts):
+        """
+        Converts each text to a list of word indices, as the Keras Tokenizer's
+         texts_to_sequences (lists of words are taken as already split).
+        """
+        sequences = list()
+        for text in texts:
+            words = text if isinstance(text, list) else \
+                text_to_word_sequence(text, self.filters, self.lower, self.split)
+            sequence = list()
+            for word in words:
+                index = self.get(word)
+                if index is not None:
+                    if not (self.num_words and index >= self.num_words):
+                        sequence.append(index)
+                elif self.oov_index is not None:
+                    sequence.append(self.oov_index)
+            sequences.append(sequence)
+        return sequences
+
+    def close(self):
+        for array in self.arrays:
+            array.release()
+        self.arrays = list()
+        self.mmap.close()
+
+
+def convert_tokenizer(tokenizer_path, vocabulary_path):
+    """
+    Converts a pickled Keras Tokenizer to a vocabulary file, checking that
+     both convert each of the vocabulary's words, and texts made of them, to
+     the same sequences.
+    """
+    with open(tokenizer_path, 'rb') as file:
+        tokenizer = pickle.load(file)
+    write_vocabulary(tokenizer, vocabulary_path)
+
+    vocabulary = Vocabulary(vocabulary_path)
+    words = list(tokenizer.word_index)
+    texts = words + [' '.join(words[idx: idx + 5]).title() + '.' for idx in range(0, len(words), 5)]
+    if vocabulary.texts_to_sequences(texts) != tokenizer.texts_to_sequences(texts):
+        raise ValueError('Vocabulary {} converts texts differently from tokenizer {}.'
+                         .format(vocabulary_path, tokenizer_path))
+    vocabulary.close()
+    return len(words)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        print(__doc__.strip().splitlines()[-1])
+        sys.exit(1)
+    tokenizer_path = sys.argv[1]
+    if len(sys.argv) == 3:
+        vocabulary_path = sys.argv[2]
+    elif tokenizer_path.endswith('.pkl'):
+        vocabulary_path = tokenizer_path[:-len('.pkl')] + '.vocab'
+    else:
+        vocabulary_path = tokenizer_path + '.vocab'
+    num_words = convert_tokenizer(tokenizer_path, vocabulary_path)
+    print('Wrote {} words to {}'.format(num_words, vocabulary_path))
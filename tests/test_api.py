@@ -0,0 +1,66 @@
+import unittest
+import numpy as np
+import tensorflow as tf
+from coref import api
+from coref.cache import normalize_text
+
+
+class Tokenizer(object):
+
+    def __init__(self):
+        self.word_index = dict()
+
+    def texts_to_sequences(self, texts):
+        return [[self.word_index.setdefault(word.lower(), len(self.word_index) + 1) for word in text.split()]
+                for text in texts]
+
+
+class PairModel(object):
+
+    def predict(self, X):
+        same = np.all(X[0] == X[1], axis=1)
+        return np.where(same, .9, .1).astype(np.float32).reshape(-1, 1)
+
+
+class OffsetsTest(unittest.TestCase):
+    """
+    Mentions' offsets index the text returned along with them, whatever the
+     normalization of the client's text.
+    """
+
+    TEXTS = [
+        '  [O presidente] visitou\t[Jose\u0301]  em   [Lisboa].\r\n',
+        '[Ele]   gostou   de [Lisboa] .',
+        '\n\n[O presidente] e [Jose\u0301] voltaram.  ',
+    ]
+
+    def setUp(self):
+        api.cached_models.models['pt'] = PairModel()
+        api.cached_models.model_graphs['pt'] = tf.get_default_graph()
+        api.cached_models.tokenizers['pt'] = Tokenizer()
+
+    def assertOffsets(self, result):
+        self.assertEqual(len(result['offsets']), len(result['mentions']))
+        for mention, (start, end) in zip(result['mentions'], result['offsets']):
+            self.assertEqual(result['text'][start: end], mention)
+
+    def test_resolve_texts(self):
+        for result in api.resolve_texts(self.TEXTS, ['pt'] * len(self.TEXTS), [False] * len(self.TEXTS)):
+            self.assertOffsets(result)
+
+    def test_session(self):
+        session_id = api.create_session('pt', False)
+        for text in self.TEXTS:
+            result = api.append_to_session(session_id, text)
+            self.assertOffsets(result)
+        self.assertEqual(len(result['mentions']), 7)
+        self.assertEqual(result, api.get_session(session_id))
+
+        # Same offsets as a single request with the normalized texts one per line
+        single, = api.resolve_texts(['\n'.join(normalize_text(text) for text in self.TEXTS)], ['pt'], [False])
+        self.assertEqual((single['text'], single['offsets']), (result['text'], result['offsets']))
+        api.delete_session(session_id)
+
+
+if __name__ == '__main__':
+    unittest.main()
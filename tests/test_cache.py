@@ -0,0 +1,63 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from coref.cache import ResultCache, normalize_text
+
+
+class NormalizeTextTest(unittest.TestCase):
+
+    def test_normalize_text(self):
+        self.assertEqual(normalize_text(' José\t  viu\r\n  a Maria. \n'), 'José viu\na Maria.')
+
+
+class ResultCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.directory, 'results.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def count_rows(self):
+        with sqlite3.connect(self.db_path) as db:
+            return db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def test_lru(self):
+        cache = ResultCache(max_entries=2)
+        for idx in range(3):
+            cache.put(str(idx), {'clusters': [[idx]]})
+        self.assertIsNone(cache.get('0'))
+        self.assertEqual(cache.get('2'), {'clusters': [[2]]})
+        self.assertEqual(cache.get_stats()['evictions'], 1)
+
+    def test_disk_tier_survives_restarts(self):
+        ResultCache(db_path=self.db_path).put('key', {'clusters': []})
+        cache = ResultCache(db_path=self.db_path)
+        self.assertEqual(cache.get('key'), {'clusters': []})
+        self.assertEqual(cache.get_stats()['disk_hits'], 1)
+
+    def test_disk_tier_bounded(self):
+        cache = ResultCache(max_entries=2, db_path=self.db_path, max_db_entries=10)
+        for idx in range(50):
+            cache.put(str(idx), {'clusters': [[idx]]})
+            self.assertLessEqual(self.count_rows(), 10)
+        self.assertIsNone(cache.get('0'))
+        self.assertEqual(cache.get('40'), {'clusters': [[40]]})
+        self.assertEqual(cache.get_stats()['disk_evictions'], 40)
+
+        # A lower bound applies on restart
+        ResultCache(db_path=self.db_path, max_db_entries=5)
+        self.assertEqual(self.count_rows(), 5)
+
+    def test_memory_hits_dont_wait_on_disk(self):
+        cache = ResultCache(db_path=self.db_path)
+        cache.put('key', {'clusters': []})
+        with cache.db_lock:
+            self.assertEqual(cache.get('key'), {'clusters': []})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import random
+import unittest
+import numpy as np
+from coref.semeval import Document, Token, Mention, MentionPairs, token_distance_between_tokens
+
+
+def sentence_loop_distance(t1, t2):
+    """
+    Token distance as previously computed, summing the lengths of the
+     sentences between the two tokens.
+    """
+    if t1.key() > t2.key():
+        t1, t2 = t2, t1
+
+    document = t1.document
+    distance = 0
+    for i in range(t1.sentence_idx, t2.sentence_idx + 1):
+        distance += len(document.sentences[i])
+        if i == t1.sentence_idx:
+            distance -= t1.get_id()
+        if i == t2.sentence_idx:
+            distance -= len(document.sentences[i]) - t2.get_id()
+    return distance
+
+
+def random_document(rng, max_sentences=8, max_sentence_length=12):
+    doc = Document('')
+    for sentence_idx in range(rng.randint(1, max_sentences)):
+        for token_id in range(1, rng.randint(1, max_sentence_length) + 1):
+            doc.add_token(Token([str(token_id), 'w{}'.format(token_id)] + ['_'] * 15, sentence_idx))
+
+    for sentence_idx, tokens in sorted(doc.sentences.items()):
+        for start in sorted(rng.sample(range(len(tokens)), rng.randint(0, len(tokens)))):
+            doc.mentions.append(Mention(tokens[start: start + rng.randint(1, 3)]))
+    return doc
+
+
+class TokenDistanceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = random.Random(1234)
+
+    def test_token_position(self):
+        for _ in range(50):
+            doc = random_document(self.rng)
+            self.assertEqual([doc.token_position(token) - doc.token_position(doc.tokens[0])
+                              for token in doc.tokens], list(range(len(doc.tokens))))
+
+    def test_distance_matches_sentence_loop(self):
+        for _ in range(50):
+            doc = random_document(self.rng)
+            for t1 in doc.tokens:
+                for t2 in doc.tokens:
+                    self.assertEqual(token_distance_between_tokens(t1, t2), sentence_loop_distance(t1, t2))
+
+    def test_mention_pairs_distance_matches_sentence_loop(self):
+        for _ in range(50):
+            doc = random_document(self.rng)
+            m1_idx, m2_idx = np.triu_indices(len(doc.mentions), k=1)
+            mps = MentionPairs(doc, m1_idx, m2_idx)
+            expected = [sentence_loop_distance(doc.mentions[i1].tokens[0], doc.mentions[i2].tokens[0])
+                        for i1, i2 in zip(m1_idx, m2_idx)]
+            self.assertEqual(mps.token_dist.tolist(), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import unittest
+import numpy as np
+import tensorflow as tf
+from coref.data import process_mention_pairs_to_distance_features
+from coref.models import SplitMentionPairModel
+from coref.semeval import Document, Token, Mention
+from coref.utils import MemCache, unique_pairs
+
+
+class PairModel(object):
+    """
+    Stand-in pair-scoring model, scoring each row from all its inputs.
+    """
+
+    def predict(self, X):
+        m1, m2, scalar = [np.asarray(x, dtype=np.float64).reshape(len(x), -1) for x in X]
+        weights = [np.arange(1, x.shape[1] + 1) for x in (m1, m2, scalar)]
+        score = (m1 * weights[0]).sum(1) + 3 * (m2 * weights[1]).sum(1) + 7 * (scalar * weights[2]).sum(1)
+        return (np.sin(score) / 2 + .5).astype(np.float32).reshape(-1, 1)
+
+
+class Encoder(object):
+    """
+    Stand-in mention encoder which, as Keras models, returns an empty list
+     for empty batches.
+    """
+
+    def predict(self, X):
+        if len(X) == 0:
+            return []
+        return np.asarray(X, dtype=np.float32)[:, -4:] / 10
+
+
+def split_model(shared_encoder=True):
+    split = SplitMentionPairModel.__new__(SplitMentionPairModel)
+    split.shared_encoder = shared_encoder
+    split.encoders = [Encoder()] if shared_encoder else [Encoder(), Encoder()]
+    split.encoding_specs = [((4,), 'float32'), ((4,), 'float32')]
+    split.head = PairModel()
+    return split
+
+
+def repeated_mentions_document(num_sentences=30):
+    doc = Document('')
+    for sentence_idx in range(num_sentences):
+        words = ['o', 'presidente', 'viu', 'a', 'Maria', 'e', 'ele', 'sorriu']
+        tokens = [Token([str(idx + 1), word], sentence_idx) for idx, word in enumerate(words)]
+        for token in tokens:
+            doc.add_token(token)
+        doc.mentions += [Mention(tokens[0:2]), Mention(tokens[3:5]), Mention(tokens[6:7])]
+    return doc
+
+
+def mention_indices(doc, max_mention_length=5):
+    vocabulary = dict()
+    X_mentions = np.zeros(shape=(len(doc.mentions), max_mention_length), dtype=np.int32)
+    for row, mention in enumerate(doc.mentions):
+        indices = [vocabulary.setdefault(token.get_string(), len(vocabulary) + 1) for token in mention.tokens]
+        X_mentions[row, -len(indices):] = indices
+    return X_mentions
+
+
+class DeduplicationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mem_cache = MemCache('')
+        self.mem_cache.models['pt'] = PairModel()
+        self.mem_cache.model_graphs['pt'] = tf.get_default_graph()
+
+    def test_unique_pairs(self):
+        mention_inputs = [np.array([[1, 2], [3, 4], [1, 2]])] * 2
+        m1_idx, m2_idx = np.array([0, 0, 1, 0, 2]), np.array([1, 2, 2, 1, 1])
+        X_scalar = np.array([[0., 1.], [0., 1.], [0., 1.], [0., 1.], [2., 1.]], dtype=np.float32)
+        unique_indices, inverse = unique_pairs(mention_inputs, m1_idx, m2_idx, X_scalar)
+        # (0, 1) and (2, 1) are the same mentions, at different distances
+        self.assertEqual(len(unique_indices), 4)
+        keys = [(tuple(mention_inputs[0][i1]), tuple(mention_inputs[1][i2]), tuple(x))
+                for i1, i2, x in zip(m1_idx, m2_idx, X_scalar)]
+        self.assertEqual([keys[unique_indices[i]] for i in inverse], keys)
+
+    def test_same_predictions_with_repeated_mentions(self):
+        doc = repeated_mentions_document()
+        mps = doc.generate_mention_pairs()
+        X_mentions = mention_indices(doc)
+        X_scalar = process_mention_pairs_to_distance_features(mps)
+
+        expected = self.mem_cache.predict_pairs('pt', X_mentions, mps.m1_idx, mps.m2_idx, X_scalar)
+        predictions = self.mem_cache.predict_pairs(
+            'pt', X_mentions, mps.m1_idx, mps.m2_idx, X_scalar, deduplicate=True)
+        np.testing.assert_array_equal(predictions, expected)
+
+        stats = self.mem_cache.get_stats('pt')
+        self.assertEqual(stats['rows'], 2 * len(mps))
+        self.assertLess(stats['predicted_rows'], len(mps) + len(mps) // 2)
+
+
+class SplitModelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mem_cache = MemCache('')
+        self.mem_cache.models['pt'] = PairModel()
+        self.mem_cache.model_graphs['pt'] = tf.get_default_graph()
+
+    def test_no_mentions(self):
+        empty = np.zeros(shape=(0,), dtype=np.int64)
+        for shared_encoder in (True, False):
+            self.mem_cache.split_models['pt'] = split_model(shared_encoder)
+            for deduplicate in (False, True):
+                X_mentions = np.zeros(shape=(0, 5), dtype=np.int32)
+                mention_inputs = self.mem_cache.encode_mentions('pt', X_mentions, deduplicate)
+                self.assertEqual([inputs.shape for inputs in mention_inputs], [(0, 4), (0, 4)])
+                predictions = self.mem_cache.predict_pairs(
+                    'pt', X_mentions, empty, empty, np.zeros(shape=(0, 2), dtype=np.float32), deduplicate)
+                self.assertEqual(predictions.shape, (0, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()